@@ -0,0 +1,14 @@
+import requests
+from .config import ALERT_WEBHOOK_URL
+
+# Problems that need an operator, as opposed to the routine log lines printed elsewhere.
+
+
+def send_alert(message):
+    print(f"ALERT: {message}")
+    if not ALERT_WEBHOOK_URL:
+        return
+    try:
+        requests.post(ALERT_WEBHOOK_URL, json={'text': message}, timeout=10)
+    except Exception as e:
+        print(f"Error sending alert: {e}")
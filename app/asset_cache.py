@@ -0,0 +1,164 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from boto3.s3.transfer import TransferConfig
+from .config import (s3_client, BUCKET_NAME, ASSET_CACHE_DIR, ASSET_CACHE_MAX_BYTES, ASSET_CACHE_MAX_WORKERS,
+                     ASSET_CACHE_LEAD_SECONDS, ASSET_CACHE_RANGE_CONCURRENCY, PREFETCH_LEAD_MINUTES)
+from .presigned_urls import get_presigned_url
+
+# Scheduled assets are downloaded once to ASSET_CACHE_DIR and played from local disk. The cache
+# is capped at ASSET_CACHE_MAX_BYTES and evicts the least recently used files first, never the
+# ones pinned for the current schedule.
+
+executor = ThreadPoolExecutor(max_workers=ASSET_CACHE_MAX_WORKERS, thread_name_prefix='asset-cache')
+transfer_config = TransferConfig(max_concurrency=ASSET_CACHE_RANGE_CONCURRENCY, multipart_chunksize=8 * 1024**2)
+_in_flight = {}
+_failed = {}
+_pinned = {}
+_lock = threading.Lock()
+
+
+def cached_path(key):
+    return os.path.abspath(os.path.join(ASSET_CACHE_DIR, key))
+
+
+def is_cached(key):
+    return os.path.exists(cached_path(key))
+
+
+def _touch(path):
+    try:
+        os.utime(path)
+    except FileNotFoundError:
+        pass
+
+
+def fetch_asset(key):
+    """Download an asset into the cache if it is not there yet; returns the local path.
+
+    Only called through prefetch_asset, which keeps a single download per key in flight.
+    """
+    path = cached_path(key)
+    if os.path.exists(path):
+        _touch(path)
+        return path
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.part"
+    try:
+        s3_client.download_file(BUCKET_NAME, key, tmp_path, Config=transfer_config)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    print(f"Cached asset: s3://{BUCKET_NAME}/{key} -> {path}")
+
+    evict()
+    return path
+
+
+def _fetch_and_forget(key):
+    try:
+        path = fetch_asset(key)
+        with _lock:
+            _failed.pop(key, None)
+        return path
+    except Exception as e:
+        print(f"Error caching asset {key}: {e}")
+        with _lock:
+            _failed[key] = str(e)
+        raise
+    finally:
+        with _lock:
+            _in_flight.pop(key, None)
+
+
+def prefetch_asset(key):
+    """Queue a background download of an asset; returns its future (None if already cached)."""
+    if is_cached(key):
+        _touch(cached_path(key))
+        return None
+    with _lock:
+        future = _in_flight.get(key)
+        if future is None:
+            future = executor.submit(_fetch_and_forget, key)
+            _in_flight[key] = future
+    return future
+
+
+def asset_status(key):
+    """'cached', 'downloading', 'failed' or None if the asset was never requested."""
+    if is_cached(key):
+        return 'cached'
+    with _lock:
+        if key in _in_flight:
+            return 'downloading'
+        return 'failed' if key in _failed else None
+
+
+def pin_assets(keys, group=None):
+    """Replace the assets of one group (a playout day) that must not be evicted."""
+    with _lock:
+        _pinned[group] = set(keys)
+
+
+def unpin_assets(group):
+    with _lock:
+        _pinned.pop(group, None)
+
+
+def resolve_asset(key, seconds_until_start, duration=0):
+    """Return what the concat playlist should reference for an asset.
+
+    Cached assets play from disk. Downloads are normally started by the look-ahead prefetch
+    scheduler; assets already inside its window are queued here. If they start far enough
+    ahead the local path is returned, otherwise a presigned URL that stays valid until the
+    asset has finished playing.
+    """
+    path = cached_path(key)
+    if os.path.exists(path):
+        _touch(path)
+        return path
+
+    if seconds_until_start <= PREFETCH_LEAD_MINUTES * 60:
+        prefetch_asset(key)
+    if seconds_until_start >= ASSET_CACHE_LEAD_SECONDS:
+        # Not there yet; rolling_playlist.secure_locking_chunks swaps in a URL before the
+        # chunk can be opened if the download has not finished by then
+        return path
+    return remote_url(key, max(seconds_until_start, 0) + duration)
+
+
+def remote_url(key, valid_seconds):
+    """Presigned URL of an asset that stays valid for at least valid_seconds."""
+    return get_presigned_url('get_object', BUCKET_NAME, key, min_valid_seconds=valid_seconds)
+
+
+def evict(max_bytes=ASSET_CACHE_MAX_BYTES):
+    """Delete least recently used files until the cache fits in max_bytes."""
+    files = []
+    for root, _, names in os.walk(ASSET_CACHE_DIR):
+        for name in names:
+            if name.endswith('.part'):
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in files)
+    if total <= max_bytes:
+        return
+
+    with _lock:
+        pinned_paths = {cached_path(key) for keys in _pinned.values() for key in keys}
+    for _, size, path in sorted(files):
+        if total <= max_bytes:
+            break
+        if os.path.abspath(path) in pinned_paths:
+            continue
+        os.remove(path)
+        total -= size
+        print(f"Evicted cached asset: {path}")
@@ -0,0 +1,210 @@
+import hashlib
+from datetime import datetime, timedelta
+import numpy as np
+from .config import AUTO_SCHEDULE_MAX_EVENTS
+from .databases import metadata_db, schedule_db
+from .utils import LOCAL_TIMEZONE
+
+# Fills a time range (hours to weeks) from a pool of assets. The play order is drawn up front
+# as an index array, and each day is laid out with one cumsum over the slot lengths instead of
+# stepping datetimes event by event. Events never cross midnight, so every day compiles on its
+# own; whole seconds keep start/end in the format /schedule-video saves.
+
+MODES = ('weighted', 'rotation')
+# Rejection passes for no_repeat before falling back to drawing one play at a time
+NO_REPEAT_PASSES = 20
+
+
+class AutoScheduleError(ValueError):
+    pass
+
+
+def _asset_color(file_name):
+    """Stable colour per asset, so the same asset looks the same across the calendar."""
+    return f"#{hashlib.md5(file_name.encode('utf-8')).hexdigest()[:6].upper()}"
+
+
+def resolve_pool(pool=None):
+    """(file_names, durations, weights) for the requested pool, or every asset with a duration."""
+    known = {record['file_name']: record['duration'] for record in metadata_db.getAll() if record.get('duration')}
+    if not pool:
+        pool = [{'file_name': file_name} for file_name in sorted(known)]
+
+    file_names, durations, weights = [], [], []
+    for entry in pool:
+        duration = entry.get('duration') or known.get(entry['file_name'])
+        if not duration or duration < 1:
+            raise AutoScheduleError(f"No usable duration for {entry['file_name']}")
+        weight = float(entry.get('weight', 1))
+        if weight <= 0:
+            continue
+        file_names.append(entry['file_name'])
+        durations.append(duration)
+        weights.append(weight)
+    if not file_names:
+        raise AutoScheduleError("The asset pool is empty")
+    return file_names, np.asarray(durations, dtype=np.float64), np.asarray(weights, dtype=np.float64)
+
+
+def play_order(count, weights, mode='weighted', no_repeat=0, rng=None):
+    """Indexes into the pool for `count` consecutive plays.
+
+    'rotation' cycles through the pool in order. 'weighted' draws each play in proportion
+    to its weight; with `no_repeat` = N an asset is not drawn again within the next N plays.
+    """
+    size = len(weights)
+    if no_repeat >= size:
+        raise AutoScheduleError(f"no_repeat must be smaller than the pool size ({size})")
+    if mode == 'rotation':
+        return np.resize(np.arange(size), count)
+
+    rng = rng or np.random.default_rng()
+    probabilities = weights / weights.sum()
+    order = rng.choice(size, size=count, p=probabilities)
+    if not no_repeat:
+        return order
+
+    # Rejection in blocks: every play that repeats one of the no_repeat plays before it is
+    # redrawn, all at once, until none does. A redraw from the full distribution that is
+    # kept follows the weights of the assets still available, as a sequential draw would.
+    for _ in range(NO_REPEAT_PASSES):
+        conflicts = np.flatnonzero(_repeats(order, no_repeat))
+        if not len(conflicts):
+            return order
+        order[conflicts] = rng.choice(size, size=len(conflicts), p=probabilities)
+
+    # Pools where nearly every asset is excluded rarely settle; draw the rest one by one
+    conflicts = np.flatnonzero(_repeats(order, no_repeat))
+    if not len(conflicts):
+        return order
+    return _draw_sequential(order, int(conflicts[0]), weights, no_repeat, rng)
+
+
+def _repeats(order, no_repeat):
+    """Mask of the plays that repeat one of the `no_repeat` plays before them."""
+    repeats = np.zeros(len(order), dtype=bool)
+    for distance in range(1, min(no_repeat, len(order) - 1) + 1):
+        repeats[distance:] |= order[distance:] == order[:-distance]
+    return repeats
+
+
+def _draw_sequential(order, first, weights, no_repeat, rng):
+    """Redraw order[first:] one play at a time, excluding the previous `no_repeat` plays."""
+    size = len(weights)
+    draws = rng.random(len(order))
+    available = weights.copy()
+    for index in order[max(first - no_repeat, 0):first]:
+        available[index] = 0.0
+    for i in range(first, len(order)):
+        if i > no_repeat:
+            available[order[i - no_repeat - 1]] = weights[order[i - no_repeat - 1]]
+        cumulative = np.cumsum(available)
+        pick = min(int(np.searchsorted(cumulative, draws[i] * cumulative[-1], side='right')), size - 1)
+        order[i] = pick
+        available[pick] = 0.0
+    return order
+
+
+def build_auto_schedule(range_start, range_end, pool=None, mode='weighted', gap_seconds=0, no_repeat=0, seed=None):
+    """Lay out plays from the pool over [range_start, range_end); returns {date: events}."""
+    if mode not in MODES:
+        raise AutoScheduleError(f"mode must be one of {', '.join(MODES)}")
+    if range_end <= range_start:
+        raise AutoScheduleError("end must be after start")
+    if gap_seconds < 0:
+        raise AutoScheduleError("gap_seconds must not be negative")
+
+    file_names, durations, weights = resolve_pool(pool)
+    # Whole-second slots; an asset loses less than a second at its tail, as with /schedule-video
+    play_seconds = np.floor(durations).astype(np.int64)
+    slot_seconds = play_seconds + int(gap_seconds)
+
+    # Midnights split the range into day windows
+    boundaries = [range_start]
+    midnight = datetime.combine(range_start.date(), datetime.min.time()) + timedelta(days=1)
+    while midnight < range_end:
+        boundaries.append(midnight)
+        midnight += timedelta(days=1)
+    boundaries.append(range_end)
+
+    total_seconds = int((range_end - range_start).total_seconds())
+    count = total_seconds // int(slot_seconds.min()) + len(boundaries)
+    if count > AUTO_SCHEDULE_MAX_EVENTS:
+        raise AutoScheduleError(f"The range needs up to {count} events, the limit is {AUTO_SCHEDULE_MAX_EVENTS}")
+    rng = np.random.default_rng(seed)
+    order = play_order(count, weights, mode, no_repeat, rng)
+    colors = [_asset_color(file_name) for file_name in file_names]
+
+    days = {}
+    used = 0
+    for window_start, window_end in zip(boundaries[:-1], boundaries[1:]):
+        window = int((window_end - window_start).total_seconds())
+        upcoming = order[used:]
+        slots = slot_seconds[upcoming]
+        starts = np.cumsum(slots) - slots
+        # Plays that end inside the window
+        fitting = int(np.searchsorted(starts + play_seconds[upcoming], window, side='right'))
+        picked = upcoming[:fitting]
+        used += fitting
+
+        base = np.datetime64(window_start.replace(microsecond=0), 's')
+        start_times = np.datetime_as_string(base + starts[:fitting].astype('timedelta64[s]'), unit='s')
+        end_times = np.datetime_as_string(
+            base + (starts[:fitting] + play_seconds[picked]).astype('timedelta64[s]'), unit='s'
+        )
+        target_ids = rng.integers(10**17, 10**18, size=fitting)
+        days[window_start.date().isoformat()] = [
+            {
+                'target_id': int(target_id),
+                'file_name': file_names[index],
+                'start_time': start_time.replace('T', ' '),
+                'end_time': end_time.replace('T', ' '),
+                'color': colors[index],
+            }
+            for index, start_time, end_time, target_id in zip(picked.tolist(), start_times, end_times, target_ids)
+        ]
+    return days
+
+
+def merge_into_schedule(days, range_start, range_end, replace=True):
+    """Combine generated days with the stored ones.
+
+    Existing events outside [range_start, range_end) are kept; inside it they are
+    replaced, or kept with the new events skipped where they overlap when `replace` is False.
+    """
+    start_text = range_start.strftime('%Y-%m-%d %H:%M:%S')
+    end_text = range_end.strftime('%Y-%m-%d %H:%M:%S')
+    merged = {}
+    for date, events in days.items():
+        schedule = schedule_db.getByQuery({"date": date})
+        existing = schedule[0]['events'] if schedule else []
+        if replace:
+            kept = [event for event in existing if not start_text <= event['start_time'] < end_text]
+            new_events = events
+        else:
+            kept = existing
+            taken = [(event['start_time'], event['end_time']) for event in existing]
+            new_events = [
+                event for event in events
+                if not any(start < event['end_time'] and event['start_time'] < end for start, end in taken)
+            ]
+        merged[date] = sorted(kept + new_events, key=lambda event: event['start_time'])
+    return merged
+
+
+def _local_time(moment):
+    """Schedules hold naive local times; an aware datetime is converted to LOCAL_TIMEZONE."""
+    if moment.tzinfo is None:
+        return moment
+    return moment.astimezone(LOCAL_TIMEZONE).replace(tzinfo=None)
+
+
+def auto_schedule(range_start, range_end, pool=None, mode='weighted', gap_seconds=0, no_repeat=0, seed=None,
+                  replace=True, dry_run=False):
+    """Generate and (unless dry_run) save a schedule for the range in one transaction."""
+    range_start, range_end = _local_time(range_start), _local_time(range_end)
+    days = build_auto_schedule(range_start, range_end, pool, mode, gap_seconds, no_repeat, seed)
+    merged = merge_into_schedule(days, range_start, range_end, replace)
+    if not dry_run:
+        schedule_db.upsert_days(merged)
+    return merged
@@ -0,0 +1,150 @@
+import os
+import re
+import time
+import threading
+from watchdog.observers import Observer
+from watchdog.events import FileSystemEventHandler
+from .config import BLOCKING_RELOAD_TIMEOUT_FACTOR, HLS_SEGMENT_SECONDS
+
+# LL-HLS blocking playlist reload (_HLS_msn / _HLS_part). A request for a media sequence the
+# encoder has not written yet waits on a Condition that is notified by a watchdog observer
+# whenever ffmpeg renames a playlist into place, so waiting requests wake when it changes.
+
+
+class BlockingReloadError(Exception):
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+
+def playlist_state(text):
+    """(last complete media sequence number, parts of the next one, target duration, ended)."""
+    media_sequence = 0
+    target_duration = HLS_SEGMENT_SECONDS
+    segments = 0
+    trailing_parts = 0
+    ended = False
+    for line in text.splitlines():
+        if line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            media_sequence = int(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-TARGETDURATION:'):
+            target_duration = float(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-PART:'):
+            trailing_parts += 1
+        elif line.startswith('#EXTINF:'):
+            segments += 1
+            trailing_parts = 0
+        elif line.startswith('#EXT-X-ENDLIST'):
+            ended = True
+    return media_sequence + segments - 1, trailing_parts, target_duration, ended
+
+
+def _satisfied(state, msn, part):
+    last_msn, trailing_parts, _, ended = state
+    if ended or msn <= last_msn:
+        return True
+    return part is not None and msn == last_msn + 1 and part < trailing_parts
+
+
+class PlaylistWatcher(FileSystemEventHandler):
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.observer = None
+        self.directory = None
+
+    def on_moved(self, event):
+        # ffmpeg writes <name>.m3u8.tmp and renames it into place
+        if event.dest_path.endswith('.m3u8'):
+            self._notify()
+
+    def on_closed(self, event):
+        if event.src_path.endswith('.m3u8'):
+            self._notify()
+
+    def _notify(self):
+        with self.condition:
+            self.condition.notify_all()
+
+    def ensure_started(self, directory):
+        with self.condition:
+            if self.observer is not None and self.directory == directory:
+                return
+            os.makedirs(directory, exist_ok=True)
+            observer = Observer()
+            observer.daemon = True
+            observer.schedule(self, directory, recursive=False)
+            observer.start()
+            self.observer, self.directory = observer, directory
+
+    def wait_for(self, path, msn, part=None, render=None):
+        """Block until the playlist at `path` contains msn (and part); returns its text.
+
+        `render` maps the file to the playlist clients see, and the sequence is checked in that.
+
+        Raises BlockingReloadError(400) for a sequence too far ahead to be produced soon and
+        BlockingReloadError(503) when it does not appear within the timeout.
+        """
+        self.ensure_started(os.path.dirname(path) or '.')
+        deadline = None
+        with self.condition:
+            while True:
+                with open(path, 'r') as f:
+                    text = f.read()
+                if render is not None:
+                    text = render(text)
+                state = playlist_state(text)
+                if _satisfied(state, msn, part):
+                    return text
+
+                last_msn, _, target_duration, _ = state
+                if deadline is None:
+                    # The spec allows rejecting requests more than two segments ahead
+                    if msn > last_msn + 2:
+                        raise BlockingReloadError(f"Media sequence {msn} is too far ahead of {last_msn}", 400)
+                    deadline = time.monotonic() + BLOCKING_RELOAD_TIMEOUT_FACTOR * target_duration
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise BlockingReloadError(f"Media sequence {msn} was not produced in time", 503)
+                self.condition.wait(remaining)
+
+    def wait_for_file(self, path, timeout):
+        """Block until `path` exists (a preload-hinted part being written); returns True if it does."""
+        self.ensure_started(os.path.dirname(path) or '.')
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            # The part is renamed into place just before the playlist listing it
+            while not os.path.exists(path):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+
+playlist_watcher = PlaylistWatcher()
+
+
+def parse_blocking_request(args):
+    """(_HLS_msn, _HLS_part) from the query string, or None if this is a normal reload."""
+    if '_HLS_msn' not in args:
+        if '_HLS_part' in args:
+            raise BlockingReloadError("_HLS_part requires _HLS_msn", 400)
+        return None
+    try:
+        msn = int(args['_HLS_msn'])
+        part = int(args['_HLS_part']) if '_HLS_part' in args else None
+    except ValueError:
+        raise BlockingReloadError("_HLS_msn and _HLS_part must be integers", 400)
+    if msn < 0 or (part is not None and part < 0):
+        raise BlockingReloadError("_HLS_msn and _HLS_part must not be negative", 400)
+    return msn, part
+
+
+def add_server_control(text, part_target=None):
+    """Advertise blocking reload support, which ffmpeg does not write itself."""
+    if '#EXT-X-SERVER-CONTROL' in text or '#EXT-X-TARGETDURATION' not in text:
+        return text
+    control = '#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES'
+    if part_target:
+        control += f',PART-HOLD-BACK={part_target * 3:.3f}'
+    return re.sub(r'^(#EXT-X-TARGETDURATION:.*)$', rf'\1\n{control}', text, count=1, flags=re.MULTILINE)
@@ -1,5 +1,6 @@
 import boto3
 import os
+import json
 
 AWS_REGION = os.getenv("AWS_REGION", "ap-south-1")
 
@@ -12,4 +13,168 @@ OUTPUT_VIDEO_DIR_FFMPEG = 'output_videos'
 upload_video_folder = 'content-scheduler/uploaded_videos'
 
 # API Base URL for the fetcher service
-API_BASE_URL = "http://video_pull_push_service:8080/api/v1/fetcher"
\ No newline at end of file
+API_BASE_URL = "http://video_pull_push_service:8080/api/v1/fetcher"
+# Service that runs the HLS encoder (its /ffmpeg/start and /processes endpoints)
+FFMPEG_SERVICE_BASE_URL = os.getenv("FFMPEG_SERVICE_BASE_URL", "http://video_ffmpeg_service:5001")
+
+# Gap filling for the concat event files.
+# 'rendered' covers each gap with a single looped blank clip rendered once per length,
+# 'repeat' falls back to repeating the 10 second blank clip.
+FILLER_MODE = os.getenv("FILLER_MODE", "rendered")
+FILLER_DIR = 'fillers'  # Relative to EVENT_FILE_DIR
+# Rendered filler clips exist in these lengths only (seconds); a gap plays the shortest one
+# that covers it, trimmed with outpoint, and longer gaps repeat the longest one first
+FILLER_LENGTHS = (60, 300, 900)
+BLANK_VIDEO_DURATION = 10  # Length of the blank clip in seconds
+
+# Rolling event files: the day's playlist is split into fixed wall-clock chunks that chain
+# into each other, so chunks ffmpeg has not opened yet can be rewritten without a restart.
+ROLLING_CHUNK_SECONDS = int(os.getenv("ROLLING_CHUNK_SECONDS", 900))
+ROLLING_LOCK_MARGIN_SECONDS = int(os.getenv("ROLLING_LOCK_MARGIN_SECONDS", 30))
+# 'daily' (default): the stream is restarted on a fresh event file every midnight.
+# 'continuous' (opt-in): the next day is prepared ahead and the encoder is re-rooted on it at
+# midnight by its supervisor, appending to the same HLS playlists, so the media sequence
+# carries on and nothing is cleared.
+PLAYOUT_MODE = os.getenv("PLAYOUT_MODE", "daily")
+CONTINUOUS_OUTPUT_NAME = 'live'
+# Operational alerts (e.g. tomorrow's playout could not be prepared) are printed and, when
+# set, POSTed as JSON {"text": ...} to this webhook
+ALERT_WEBHOOK_URL = os.getenv("ALERT_WEBHOOK_URL")
+
+# SQLite database holding schedules and asset metadata
+SQLITE_DB_PATH = os.getenv("SQLITE_DB_PATH", "video_scheduler.db")
+
+# Parallel ffprobe runs when filling in missing media metadata
+PROBE_MAX_WORKERS = int(os.getenv("PROBE_MAX_WORKERS", 4))
+
+# Bulk ingest: parallel probe/register workers and how long to wait for each upload
+INGEST_MAX_WORKERS = int(os.getenv("INGEST_MAX_WORKERS", 8))
+INGEST_UPLOAD_TIMEOUT_SECONDS = int(os.getenv("INGEST_UPLOAD_TIMEOUT_SECONDS", 3600))
+# Completed ingest jobs stay queryable for this long
+INGEST_JOB_TTL_SECONDS = int(os.getenv("INGEST_JOB_TTL_SECONDS", 24 * 3600))
+
+# Presigned URL cache: URLs are reused while at least PRESIGNED_URL_MIN_REMAINING_SECONDS of validity is left
+PRESIGNED_URL_EXPIRY_SECONDS = int(os.getenv("PRESIGNED_URL_EXPIRY_SECONDS", 3600))
+PRESIGNED_URL_MIN_REMAINING_SECONDS = int(os.getenv("PRESIGNED_URL_MIN_REMAINING_SECONDS", 900))
+PRESIGNED_URL_CACHE_SIZE = 10000
+
+# Local read-through cache of scheduled assets so ffmpeg reads from disk instead of S3
+ASSET_CACHE_DIR = os.getenv("ASSET_CACHE_DIR", "./asset_cache/")
+ASSET_CACHE_MAX_BYTES = int(os.getenv("ASSET_CACHE_MAX_BYTES", 20 * 1024**3))
+ASSET_CACHE_MAX_WORKERS = int(os.getenv("ASSET_CACHE_MAX_WORKERS", 4))
+# Assets starting sooner than this are played from a presigned URL if not cached yet
+ASSET_CACHE_LEAD_SECONDS = int(os.getenv("ASSET_CACHE_LEAD_SECONDS", 600))
+# Parallel ranged GETs per asset download (total is ASSET_CACHE_MAX_WORKERS times this)
+ASSET_CACHE_RANGE_CONCURRENCY = int(os.getenv("ASSET_CACHE_RANGE_CONCURRENCY", 4))
+
+# Look-ahead prefetch: each scheduled asset is downloaded this long before its start_time
+PREFETCH_LEAD_MINUTES = int(os.getenv("PREFETCH_LEAD_MINUTES", 30))
+PREFETCH_POLL_SECONDS = int(os.getenv("PREFETCH_POLL_SECONDS", 30))
+
+# HLS segment/playlist upload pipeline
+SEGMENT_UPLOAD_WORKERS = int(os.getenv("SEGMENT_UPLOAD_WORKERS", 8))
+
+# Parallel delete_objects batches when cleaning S3 prefixes
+S3_CLEANUP_WORKERS = int(os.getenv("S3_CLEANUP_WORKERS", 4))
+# /s3-cleanup only deletes generated HLS output (live segments and the asset library), never uploads
+S3_CLEANUP_ALLOWED_PREFIXES = ('hls/', 'hls-library/')
+
+# Adaptive bitrate ladder for the HLS output, decoded once and fanned out with split=N.
+# ABR_LADDER (JSON) replaces the default ladder, ABR_RENDITIONS picks renditions by name.
+DEFAULT_ABR_LADDER = [
+    {"name": "1080p", "width": 1920, "height": 1080, "video_bitrate": "5000k", "maxrate": "5350k", "bufsize": "7500k", "audio_bitrate": "128k"},
+    {"name": "720p", "width": 1280, "height": 720, "video_bitrate": "2800k", "maxrate": "2996k", "bufsize": "4200k", "audio_bitrate": "128k"},
+    {"name": "480p", "width": 854, "height": 480, "video_bitrate": "1400k", "maxrate": "1498k", "bufsize": "2100k", "audio_bitrate": "128k"},
+    {"name": "360p", "width": 640, "height": 360, "video_bitrate": "800k", "maxrate": "856k", "bufsize": "1200k", "audio_bitrate": "96k"},
+]
+ABR_LADDER = json.loads(os.getenv("ABR_LADDER")) if os.getenv("ABR_LADDER") else DEFAULT_ABR_LADDER
+if os.getenv("ABR_RENDITIONS"):
+    ABR_LADDER = [rung for rung in ABR_LADDER if rung["name"] in os.getenv("ABR_RENDITIONS").split(",")]
+HLS_SEGMENT_SECONDS = 6
+
+# Encoder profiles used by the HLS and RTMP pipelines (see app/encoding.py)
+HLS_ENCODER_PROFILE = os.getenv("HLS_ENCODER_PROFILE", "hls")
+RTMP_ENCODER_PROFILE = os.getenv("RTMP_ENCODER_PROFILE", "rtmp")
+CPU_SATURATION_PERCENT = int(os.getenv("CPU_SATURATION_PERCENT", 85))
+
+# Low-latency HLS: fMP4 parts of LOW_LATENCY_PART_SECONDS grouped into segments of
+# LOW_LATENCY_PARTS_PER_SEGMENT parts, advertised with EXT-X-PART. HLS_LATENCY_MODE is the
+# default for a channel ('standard' or 'low'); a stream start can override it.
+HLS_LATENCY_MODE = os.getenv("HLS_LATENCY_MODE", "standard")
+LATENCY_MODES = ("standard", "low")
+LOW_LATENCY_PART_SECONDS = float(os.getenv("LOW_LATENCY_PART_SECONDS", 1.0))
+LOW_LATENCY_PARTS_PER_SEGMENT = int(os.getenv("LOW_LATENCY_PARTS_PER_SEGMENT", 4))
+LOW_LATENCY_ENCODER_PROFILE = os.getenv("LOW_LATENCY_ENCODER_PROFILE", "hls-ll")
+
+# Remux fast path: when every asset of the day already matches this spec the HLS output is
+# stream-copied instead of transcoded. REMUX_MODE is 'auto' or 'off'. In continuous playout each
+# day is checked when the encoder is re-rooted on it, and only a single-rendition ABR_LADDER is
+# stream-copied: a copy has just the top rendition, and the live master playlist must keep the
+# same variants from one day to the next.
+REMUX_MODE = os.getenv("REMUX_MODE", "auto")
+OUTPUT_SPEC = {
+    "video_codec": "h264",
+    "pix_fmt": "yuv420p",
+    "audio_codec": "aac",
+    "width": ABR_LADDER[0]["width"],
+    "height": ABR_LADDER[0]["height"],
+    "max_keyframe_interval": HLS_SEGMENT_SECONDS,
+}
+
+# Pre-segmented asset library: every asset is encoded once into the channel's HLS ladder
+# under OUTPUT_VIDEO_DIR/library/<etag>/ (served by /output_videos) and mirrored to S3.
+LIBRARY_DIR_NAME = 'library'
+LIBRARY_S3_PREFIX = 'hls-library/'
+LIBRARY_ENCODER_PROFILE = os.getenv("LIBRARY_ENCODER_PROFILE", "hls-quality")
+LIBRARY_MAX_WORKERS = int(os.getenv("LIBRARY_MAX_WORKERS", 1))
+LIBRARY_UPLOAD = os.getenv("LIBRARY_UPLOAD", "1") == "1"
+
+# Playlist stitcher: live playlists built from the schedule over pre-segmented library assets
+STITCHER_WINDOW_SEGMENTS = int(os.getenv("STITCHER_WINDOW_SEGMENTS", 10))
+STITCHER_CACHE_SECONDS = int(os.getenv("STITCHER_CACHE_SECONDS", 60))
+STITCHED_PLAYLIST_PREFIX = 'stitched_'
+
+# /output_videos serving: in-memory LRU of recently served segments and cache policies
+SEGMENT_MEMORY_CACHE_BYTES = int(os.getenv("SEGMENT_MEMORY_CACHE_BYTES", 256 * 1024**2))
+SEGMENT_MEMORY_CACHE_MAX_ITEM_BYTES = int(os.getenv("SEGMENT_MEMORY_CACHE_MAX_ITEM_BYTES", 16 * 1024**2))
+SEGMENT_MEMORY_CACHE_TTL_SECONDS = int(os.getenv("SEGMENT_MEMORY_CACHE_TTL_SECONDS", 300))
+SEGMENT_MAX_AGE_SECONDS = 365 * 24 * 3600
+PLAYLIST_MAX_AGE_SECONDS = int(os.getenv("PLAYLIST_MAX_AGE_SECONDS", 1))
+
+# LL-HLS blocking playlist reload: a request for a media sequence that is not yet written is
+# held until it is, for at most this many target durations
+BLOCKING_RELOAD_TIMEOUT_FACTOR = 3
+
+# Supervised ffmpeg jobs (see app/process_manager.py)
+MAX_CONCURRENT_JOBS = int(os.getenv("MAX_CONCURRENT_JOBS", 8))
+RESTART_BACKOFF_INITIAL_SECONDS = float(os.getenv("RESTART_BACKOFF_INITIAL_SECONDS", 1))
+RESTART_BACKOFF_MAX_SECONDS = float(os.getenv("RESTART_BACKOFF_MAX_SECONDS", 60))
+# A run that lasted this long resets the backoff
+RESTART_BACKOFF_RESET_SECONDS = 60
+# RTMP relays of a finite input replay it after this pause
+RTMP_RESTART_DELAY_SECONDS = 5
+PROCESS_STOP_TIMEOUT_SECONDS = 10
+
+# ffmpeg -progress ingestion: samples kept per job (one every ~0.5s) and stderr lines kept
+PROGRESS_HISTORY_SIZE = int(os.getenv("PROGRESS_HISTORY_SIZE", 600))
+FFMPEG_LOG_HISTORY_SIZE = 200
+# A job encoding slower than this for PROGRESS_SLOW_SAMPLES samples in a row is flagged
+PROGRESS_MIN_SPEED = 0.98
+PROGRESS_SLOW_SAMPLES = 10
+
+# Drift monitor: compares the HLS encoder's -progress out_time with the rolling timeline and,
+# with DRIFT_AUTO_CORRECT, trims or extends the next filler gap to pull events back on time
+HLS_JOB_ID = 'hls-playout'
+DRIFT_POLL_SECONDS = int(os.getenv("DRIFT_POLL_SECONDS", 15))
+DRIFT_AUTO_CORRECT = os.getenv("DRIFT_AUTO_CORRECT", "true").lower() == "true"
+DRIFT_CORRECTION_THRESHOLD_SECONDS = float(os.getenv("DRIFT_CORRECTION_THRESHOLD_SECONDS", 1.0))
+# A trimmed filler keeps at least this much; an extended one grows by at most DRIFT_MAX_EXTEND_SECONDS
+DRIFT_MIN_FILLER_SECONDS = 1.0
+DRIFT_MAX_EXTEND_SECONDS = 300
+DRIFT_HISTORY_SIZE = 240
+
+# Schedule compiler: every boundary of the compiled timeline falls on a frame at this rate
+COMPILER_FRAME_RATE = os.getenv("COMPILER_FRAME_RATE", "25")
+
+# Auto-scheduler: upper bound on the events one request may generate
+AUTO_SCHEDULE_MAX_EVENTS = int(os.getenv("AUTO_SCHEDULE_MAX_EVENTS", 500000))
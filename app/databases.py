@@ -1,25 +1,414 @@
-from pysondb import db
+import os
+import json
+import random
+import sqlite3
+import threading
+from .config import SQLITE_DB_PATH
 
-metadata_db = db.getDb("metadata_db.json")
-schedule_db = db.getDb("schedule_db.json")
+# Schedules and asset metadata live in SQLite (WAL mode) instead of the pysondb JSON files.
+# metadata_db and schedule_db keep the pysondb style getByQuery/getAll/add interface.
 
-def add_metadata(file_name, bucket_name, duration):
+METADATA_JSON_FILE = "metadata_db.json"
+SCHEDULE_JSON_FILE = "schedule_db.json"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (
+    id INTEGER PRIMARY KEY,
+    file_name TEXT NOT NULL,
+    bucket_name TEXT,
+    duration REAL
+);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_metadata_file_name ON metadata (file_name);
+
+CREATE TABLE IF NOT EXISTS schedule_days (
+    date TEXT PRIMARY KEY,
+    id INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS schedule_events (
+    date TEXT NOT NULL REFERENCES schedule_days (date) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    start_time TEXT NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_schedule_events_date_start ON schedule_events (date, start_time);
+
+CREATE TABLE IF NOT EXISTS asset_library (
+    etag TEXT PRIMARY KEY,
+    file_name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    mode TEXT,
+    duration REAL,
+    renditions TEXT,
+    error TEXT,
+    updated_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS compiled_schedules (
+    date TEXT PRIMARY KEY,
+    source_hash TEXT NOT NULL,
+    compiled TEXT NOT NULL,
+    compiled_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS stitch_sequences (
+    rendition TEXT NOT NULL,
+    date TEXT NOT NULL,
+    media_sequence INTEGER NOT NULL,
+    segments INTEGER NOT NULL,
+    discontinuity_sequence INTEGER NOT NULL,
+    discontinuities INTEGER NOT NULL,
+    PRIMARY KEY (rendition, date)
+);
+
+CREATE TABLE IF NOT EXISTS media_probes (
+    etag TEXT PRIMARY KEY,
+    info TEXT NOT NULL,
+    probe TEXT NOT NULL,
+    probed_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+_local = threading.local()
+
+
+def generate_id():
+    """Random 18-digit id, the same shape pysondb used."""
+    return random.randint(10**17, 10**18 - 1)
+
+
+def get_connection():
+    """Return this thread's connection to the SQLite database."""
+    connection = getattr(_local, 'connection', None)
+    if connection is None:
+        connection = sqlite3.connect(SQLITE_DB_PATH, timeout=30)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute("PRAGMA foreign_keys=ON")
+        _local.connection = connection
+    return connection
+
+
+def _where(query, columns):
+    unknown = set(query) - set(columns)
+    if unknown:
+        raise ValueError(f"Unsupported query fields: {sorted(unknown)}")
+    clause = " AND ".join(f"{key} = ?" for key in query)
+    return (f" WHERE {clause}" if clause else ""), list(query.values())
+
+
+class MetadataStore:
+    columns = ('id', 'file_name', 'bucket_name', 'duration', 'etag')
+
+    def getAll(self):
+        rows = get_connection().execute("SELECT * FROM metadata ORDER BY rowid").fetchall()
+        return [dict(row) for row in rows]
+
+    def getByQuery(self, query):
+        where, params = _where(query, self.columns)
+        rows = get_connection().execute(f"SELECT * FROM metadata{where} ORDER BY rowid", params).fetchall()
+        return [dict(row) for row in rows]
+
+    def add(self, data):
+        """Insert a metadata record; returns its id, or None if the file_name already exists."""
+        record_id = data.get('id') or generate_id()
+        with get_connection() as connection:
+            cursor = connection.execute(
+                "INSERT OR IGNORE INTO metadata (id, file_name, bucket_name, duration, etag) VALUES (?, ?, ?, ?, ?)",
+                (record_id, data['file_name'], data.get('bucket_name'), data.get('duration'), data.get('etag'))
+            )
+        return record_id if cursor.rowcount else None
+
+    def update(self, file_name, **fields):
+        """Update columns of the record for file_name; returns True if it exists."""
+        _, params = _where(fields, self.columns)
+        assignments = ", ".join(f"{key} = ?" for key in fields)
+        with get_connection() as connection:
+            cursor = connection.execute(
+                f"UPDATE metadata SET {assignments} WHERE file_name = ?", params + [file_name]
+            )
+        return cursor.rowcount > 0
+
+
+class ScheduleStore:
+    columns = ('id', 'date')
+
+    def _load_days(self, rows):
+        connection = get_connection()
+        days = []
+        for row in rows:
+            events = connection.execute(
+                "SELECT data FROM schedule_events WHERE date = ? ORDER BY position",
+                (row['date'],)
+            ).fetchall()
+            days.append({
+                'date': row['date'],
+                'events': [json.loads(event['data']) for event in events],
+                'id': row['id']
+            })
+        return days
+
+    def getAll(self):
+        rows = get_connection().execute("SELECT * FROM schedule_days ORDER BY date").fetchall()
+        return self._load_days(rows)
+
+    def getByQuery(self, query):
+        where, params = _where(query, self.columns)
+        rows = get_connection().execute(f"SELECT * FROM schedule_days{where} ORDER BY date", params).fetchall()
+        return self._load_days(rows)
+
+    def _insert_day(self, connection, entry):
+        entry_id = entry.get('id') or generate_id()
+        connection.execute("INSERT INTO schedule_days (date, id) VALUES (?, ?)", (entry['date'], entry_id))
+        connection.executemany(
+            "INSERT INTO schedule_events (date, position, start_time, data) VALUES (?, ?, ?, ?)",
+            [
+                (entry['date'], position, event['start_time'], json.dumps(event))
+                for position, event in enumerate(entry.get('events', []))
+            ]
+        )
+        return entry_id
+
+    def add(self, entry):
+        """Insert a day entry ({'date', 'events', 'id'}); returns its id."""
+        with get_connection() as connection:
+            return self._insert_day(connection, entry)
+
+    def upsert_day(self, date, events):
+        """Replace the events of one day in a single transaction; returns the day's id.
+
+        Only that day's rows are touched, so the cost does not grow with the schedule
+        history and saves for different days do not overwrite each other.
+        """
+        connection = get_connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.execute(
+                "INSERT INTO schedule_days (date, id) VALUES (?, ?) ON CONFLICT (date) DO NOTHING",
+                (date, generate_id())
+            )
+            day_id = connection.execute("SELECT id FROM schedule_days WHERE date = ?", (date,)).fetchone()['id']
+            connection.execute("DELETE FROM schedule_events WHERE date = ?", (date,))
+            connection.executemany(
+                "INSERT INTO schedule_events (date, position, start_time, data) VALUES (?, ?, ?, ?)",
+                [(date, position, event['start_time'], json.dumps(event)) for position, event in enumerate(events)]
+            )
+        return day_id
+
+    def upsert_days(self, days):
+        """Replace the events of several days ({date: events}) in one transaction."""
+        connection = get_connection()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            connection.executemany(
+                "INSERT INTO schedule_days (date, id) VALUES (?, ?) ON CONFLICT (date) DO NOTHING",
+                [(date, generate_id()) for date in days]
+            )
+            connection.executemany("DELETE FROM schedule_events WHERE date = ?", [(date,) for date in days])
+            connection.executemany(
+                "INSERT INTO schedule_events (date, position, start_time, data) VALUES (?, ?, ?, ?)",
+                [
+                    (date, position, event['start_time'], json.dumps(event))
+                    for date, events in days.items()
+                    for position, event in enumerate(events)
+                ]
+            )
+
+    def delete_day(self, date):
+        """Remove a day and its events; returns True if the day existed."""
+        with get_connection() as connection:
+            connection.execute("DELETE FROM schedule_events WHERE date = ?", (date,))
+            cursor = connection.execute("DELETE FROM schedule_days WHERE date = ?", (date,))
+        return cursor.rowcount > 0
+
+
+class ProbeStore:
+    """Full ffprobe results keyed by the S3 ETag of the probed content."""
+
+    def get(self, etag):
+        row = get_connection().execute("SELECT info, probe FROM media_probes WHERE etag = ?", (etag,)).fetchone()
+        if row is None:
+            return None
+        return {'info': json.loads(row['info']), 'probe': json.loads(row['probe'])}
+
+    def put(self, etag, info, probe):
+        with get_connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO media_probes (etag, info, probe) VALUES (?, ?, ?)",
+                (etag, json.dumps(info), json.dumps(probe))
+            )
+
+    def get_by_file_name(self, file_name):
+        row = get_connection().execute(
+            "SELECT p.info, p.probe FROM metadata m JOIN media_probes p ON p.etag = m.etag WHERE m.file_name = ?",
+            (file_name,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {'info': json.loads(row['info']), 'probe': json.loads(row['probe'])}
+
+
+class LibraryStore:
+    """Pre-segmented HLS renditions of each asset, keyed by the ETag of its content."""
+
+    def _row(self, row):
+        if row is None:
+            return None
+        entry = dict(row)
+        entry['renditions'] = json.loads(entry['renditions']) if entry['renditions'] else {}
+        return entry
+
+    def get(self, etag):
+        return self._row(get_connection().execute("SELECT * FROM asset_library WHERE etag = ?", (etag,)).fetchone())
+
+    def get_by_file_name(self, file_name):
+        connection = get_connection()
+        row = connection.execute(
+            "SELECT l.* FROM metadata m JOIN asset_library l ON l.etag = m.etag WHERE m.file_name = ?",
+            (file_name,)
+        ).fetchone()
+        if row is None:
+            # Files built without a metadata record (the blank filler)
+            row = connection.execute(
+                "SELECT * FROM asset_library WHERE file_name = ? ORDER BY updated_at DESC LIMIT 1", (file_name,)
+            ).fetchone()
+        return self._row(row)
+
+    def getAll(self):
+        rows = get_connection().execute("SELECT * FROM asset_library ORDER BY updated_at").fetchall()
+        return [self._row(row) for row in rows]
+
+    def put(self, etag, file_name, status, mode=None, duration=None, renditions=None, error=None):
+        with get_connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO asset_library (etag, file_name, status, mode, duration, renditions, error, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)",
+                (etag, file_name, status, mode, duration, json.dumps(renditions) if renditions else None, error)
+            )
+
+
+class CompiledScheduleStore:
+    """Compiled playout timelines (see schedule_compiler), keyed by date."""
+
+    def get(self, date):
+        row = get_connection().execute(
+            "SELECT source_hash, compiled FROM compiled_schedules WHERE date = ?", (date,)
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(json.loads(row['compiled']), source_hash=row['source_hash'])
+
+    def put(self, date, source_hash, compiled):
+        with get_connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO compiled_schedules (date, source_hash, compiled, compiled_at) "
+                "VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
+                (date, source_hash, json.dumps(compiled))
+            )
+
+    def delete(self, date):
+        with get_connection() as connection:
+            connection.execute("DELETE FROM compiled_schedules WHERE date = ?", (date,))
+
+
+class StitchSequenceStore:
+    """Media and discontinuity sequence of the first stitched segment of each day, per rendition."""
+
+    def get(self, rendition, date):
+        row = get_connection().execute(
+            "SELECT * FROM stitch_sequences WHERE rendition = ? AND date = ?", (rendition, date)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def latest_before(self, rendition, date):
+        row = get_connection().execute(
+            "SELECT * FROM stitch_sequences WHERE rendition = ? AND date < ? ORDER BY date DESC LIMIT 1",
+            (rendition, date)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def put(self, rendition, date, media_sequence, segments, discontinuity_sequence, discontinuities):
+        with get_connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO stitch_sequences "
+                "(rendition, date, media_sequence, segments, discontinuity_sequence, discontinuities) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (rendition, date, media_sequence, segments, discontinuity_sequence, discontinuities)
+            )
+
+
+def init_db():
+    connection = get_connection()
+    connection.executescript(SCHEMA)
+
+    # Columns added after the first release of the schema
+    metadata_columns = {row['name'] for row in connection.execute("PRAGMA table_info(metadata)")}
+    if 'etag' not in metadata_columns:
+        connection.execute("ALTER TABLE metadata ADD COLUMN etag TEXT")
+    connection.execute("CREATE INDEX IF NOT EXISTS idx_metadata_etag ON metadata (etag)")
+    connection.commit()
+
+
+def _read_json_records(path):
     try:
-        # Check if the file already exists in the database
-        existing_metadata = metadata_db.getByQuery({"file_name": file_name})
-        if existing_metadata:
-            print(f"Metadata for {file_name} already exists.")
-            return False
+        with open(path, 'r') as f:
+            content = f.read().strip()
+        return json.loads(content).get('data', []) if content else []
+    except FileNotFoundError:
+        return []
+
+
+def migrate_from_json(metadata_file=METADATA_JSON_FILE, schedule_file=SCHEDULE_JSON_FILE):
+    """One-shot import of the pysondb JSON files. Records that already exist are skipped."""
+    metadata_count = 0
+    for record in _read_json_records(metadata_file):
+        if metadata_db.add(record):
+            metadata_count += 1
+
+    schedule_count = 0
+    existing_dates = {row['date'] for row in get_connection().execute("SELECT date FROM schedule_days")}
+    for entry in _read_json_records(schedule_file):
+        if entry['date'] in existing_dates:
+            continue
+        schedule_db.add(entry)
+        existing_dates.add(entry['date'])
+        schedule_count += 1
+
+    print(f"Migrated {metadata_count} metadata record(s) and {schedule_count} schedule day(s) to {SQLITE_DB_PATH}")
 
-        # Add the metadata to the database
-        metadata_db.add({
+
+metadata_db = MetadataStore()
+schedule_db = ScheduleStore()
+probe_db = ProbeStore()
+library_db = LibraryStore()
+compiled_schedule_db = CompiledScheduleStore()
+stitch_sequence_db = StitchSequenceStore()
+
+_new_database = not os.path.exists(SQLITE_DB_PATH)
+init_db()
+if _new_database:
+    migrate_from_json()
+
+
+def add_metadata(file_name, bucket_name, duration, etag=None):
+    try:
+        # The unique index on file_name makes the existence check and insert atomic
+        if metadata_db.add({
             "file_name": file_name,
             "bucket_name": bucket_name,
-            "duration": duration
-        })
+            "duration": duration,
+            "etag": etag
+        }) is None:
+            print(f"Metadata for {file_name} already exists.")
+            return False
+
         print(f"Metadata for {file_name} added successfully.")
         return True
     except Exception as e:
         print(f"Error adding metadata: {e}")
         return False
 
+
+if __name__ == '__main__':
+    migrate_from_json()
@@ -0,0 +1,163 @@
+import threading
+import requests
+from collections import deque
+from datetime import datetime, timedelta
+from .config import (HLS_JOB_ID, DRIFT_AUTO_CORRECT, DRIFT_CORRECTION_THRESHOLD_SECONDS, DRIFT_HISTORY_SIZE,
+                     FFMPEG_SERVICE_BASE_URL)
+from .process_manager import supervisor
+from .rolling_playlist import load_manifest, first_mutable_chunk, regenerate_event_file, playing_dates, next_date
+from .utils import LOCAL_TIMEZONE
+
+# Playout drift: where the encoder is (its -progress out_time) against where the rolling
+# timeline says it should be. Every item of the rolling manifest carries its scheduled start
+# and the duration it really plays, so the offset of each item in the encoder's output is
+# known; drift is the time it actually airs minus the time it was scheduled. Positive drift
+# means playout is late.
+#
+# A run may have started on an earlier day whose files are already cleaned up, so the walk
+# starts at the manifest of the day playing now, with out_time less what the earlier days played.
+#
+# The encoder normally runs in the ffmpeg service, not in this process; its job (state,
+# metadata and latest progress sample) is then read from the service's /processes endpoint.
+
+_history = deque(maxlen=DRIFT_HISTORY_SIZE)
+_latest = {}
+_lock = threading.Lock()
+
+
+def _playout_items(manifest):
+    """Manifest items in play order with the chunk they are in and their offset in the output."""
+    offset = 0.0
+    for index in sorted(manifest['chunks'], key=int):
+        for record in manifest['chunks'][index].get('items', []):
+            yield int(index), offset, record
+            offset += record['duration']
+
+
+def _midnight(date):
+    return LOCAL_TIMEZONE.localize(datetime.fromisoformat(date))
+
+
+def _played_before(start_date, date, run_start):
+    """Seconds of output played by the days from start_date up to (not including) date."""
+    played = 0.0
+    day = start_date
+    while day < date:
+        manifest = load_manifest(day)
+        if manifest and 'start' in manifest:
+            played += sum(record['duration'] for _, _, record in _playout_items(manifest))
+        else:
+            # Already cleaned up: the day ran from the run's start (or midnight) to the next midnight
+            played += (_midnight(next_date(day)) - max(_midnight(day), run_start)).total_seconds()
+        day = next_date(day)
+    return played
+
+
+def measure_drift(start_date, sample):
+    """Drift of the playing position and of every upcoming event from one progress sample.
+
+    `start_date` is the day the encoder run started on.
+    """
+    measured_at = datetime.fromtimestamp(sample['time'], LOCAL_TIMEZONE)
+    date = max(start_date or '', playing_dates(measured_at)[0])
+    manifest = load_manifest(date)
+    if not manifest or 'start' not in manifest:
+        return None
+
+    run_start = measured_at - timedelta(seconds=sample['out_time'])
+    position = sample['out_time'] - _played_before(start_date or date, date, run_start)
+    first_mutable = first_mutable_chunk(date, manifest, measured_at)
+
+    result = {
+        'date': date,
+        'measured_at': measured_at.isoformat(),
+        'out_time': sample['out_time'],
+        'position': position,
+        'drift_seconds': None,
+        'correctable_drift_seconds': None,
+        'events': []
+    }
+    for index, offset, record in _playout_items(manifest):
+        scheduled = datetime.fromisoformat(record['start'])
+        # Content at `offset` airs (offset - position) seconds after the sample was taken
+        drift = (measured_at - scheduled).total_seconds() + offset - position
+        if offset <= position < offset + record['duration']:
+            result['drift_seconds'] = round(drift, 3)
+        if index >= first_mutable and result['correctable_drift_seconds'] is None:
+            # The drift at the start of the first rewritable chunk is what a correction absorbs
+            result['correctable_drift_seconds'] = round(drift, 3)
+        if record['kind'] == 'event' and offset + record['duration'] > position:
+            result['events'].append({
+                'file_name': record['file_name'],
+                'scheduled_start': record['start'],
+                'drift_seconds': round(drift, 3)
+            })
+    return result
+
+
+def _playout_job():
+    """(job, source) for the HLS encoder, from this process's supervisor or the ffmpeg service."""
+    job = supervisor.get(HLS_JOB_ID)
+    if job is not None:
+        return job, 'local'
+    response = requests.get(f"{FFMPEG_SERVICE_BASE_URL}/processes/{HLS_JOB_ID}", timeout=5)
+    if response.status_code == 404:
+        return None, 'ffmpeg-service'
+    response.raise_for_status()
+    return response.json(), 'ffmpeg-service'
+
+
+def _set_status(status, **fields):
+    with _lock:
+        _latest.clear()
+        _latest.update(fields, status=status, checked_at=datetime.now(LOCAL_TIMEZONE).isoformat())
+
+
+def check_drift():
+    """Measure the HLS channel's drift and, if enabled, correct it in the next filler gap."""
+    try:
+        try:
+            job, source = _playout_job()
+        except requests.RequestException as e:
+            _set_status('unavailable', error=f"ffmpeg service unreachable: {e}")
+            return
+        if job is None or job['state'] != 'running':
+            _set_status('not running', source=source, state=job['state'] if job else None)
+            return
+        sample = job['progress']
+        if not sample or sample.get('out_time') is None:
+            _set_status('no progress', source=source)
+            return
+        result = measure_drift(job['metadata'].get('date'), sample)
+        if result is None:
+            _set_status('no timeline', source=source)
+            return
+        date = result['date']
+        result['status'] = 'measured'
+        result['source'] = source
+
+        correction = result['correctable_drift_seconds']
+        result['corrected'] = False
+        if DRIFT_AUTO_CORRECT and correction is not None and abs(correction) >= DRIFT_CORRECTION_THRESHOLD_SECONDS:
+            print(f"Playout drift for {date} is {correction:.3f}s, correcting in the next filler gap")
+            result['corrected'] = bool(regenerate_event_file(date, drift_seconds=correction))
+
+        with _lock:
+            _latest.clear()
+            _latest.update(result)
+            _history.append({
+                'measured_at': result['measured_at'],
+                'drift_seconds': result['drift_seconds'],
+                'corrected': result['corrected']
+            })
+    except Exception as e:
+        print(f"Error checking playout drift: {e}")
+        _set_status('error', error=str(e))
+
+
+def get_drift_status(history=False):
+    with _lock:
+        status = dict(_latest)
+        if history:
+            status['history'] = list(_history)
+    return status
@@ -0,0 +1,301 @@
+import os
+import time
+import psutil
+from .config import (ABR_LADDER, HLS_SEGMENT_SECONDS, CPU_SATURATION_PERCENT, HLS_ENCODER_PROFILE, REMUX_MODE, OUTPUT_SPEC,
+                     LOW_LATENCY_PART_SECONDS, LOW_LATENCY_PARTS_PER_SEGMENT, LOW_LATENCY_ENCODER_PROFILE,
+                     CONTINUOUS_OUTPUT_NAME)
+from .databases import schedule_db
+from .media_probe import get_media_info
+from .utils import BLANK_VIDEO_PATH
+
+# Named encoder profiles. preset 'auto' is resolved from the cores available per running
+# encoder and the pixel load of the output, and stepped down while the CPU is saturated.
+# Rates left as None come from the ABR ladder rung being encoded.
+ENCODER_PROFILES = {
+    'hls': {
+        'preset': 'auto', 'tune': None, 'gop_seconds': HLS_SEGMENT_SECONDS, 'threads': 'auto',
+        'rate_control': 'vbr', 'video_bitrate': None, 'maxrate': None, 'bufsize': None,
+    },
+    'hls-quality': {
+        'preset': 'medium', 'tune': 'film', 'gop_seconds': HLS_SEGMENT_SECONDS, 'threads': 'auto',
+        'rate_control': 'vbr', 'video_bitrate': None, 'maxrate': None, 'bufsize': None,
+    },
+    # Keyframe on every low-latency part so each part is independently decodable
+    'hls-ll': {
+        'preset': 'auto', 'tune': 'zerolatency', 'gop_seconds': LOW_LATENCY_PART_SECONDS, 'threads': 'auto',
+        'rate_control': 'vbr', 'video_bitrate': None, 'maxrate': None, 'bufsize': None,
+    },
+    'rtmp': {
+        'preset': 'veryfast', 'tune': None, 'gop_seconds': 2, 'threads': 'auto',
+        'rate_control': 'cbr', 'video_bitrate': '750K', 'maxrate': '750K', 'bufsize': '1500K',
+    },
+    'rtmp-auto': {
+        'preset': 'auto', 'tune': 'zerolatency', 'gop_seconds': 2, 'threads': 'auto',
+        'rate_control': 'cbr', 'video_bitrate': '750K', 'maxrate': '750K', 'bufsize': '1500K',
+    },
+}
+
+# Fastest to slowest; 'auto' picks an index into this list
+PRESETS = ['ultrafast', 'superfast', 'veryfast', 'faster', 'fast', 'medium', 'slow']
+PIXELS_1080P = 1920 * 1080
+
+
+def count_running_encoders():
+    """Number of ffmpeg processes currently running on this host."""
+    count = 0
+    for process in psutil.process_iter(attrs=['name']):
+        if process.info['name'] and 'ffmpeg' in process.info['name']:
+            count += 1
+    return count
+
+
+def choose_preset(concurrent_streams, output_pixels=PIXELS_1080P):
+    """Pick an x264 preset from the cores per stream, the output load and current CPU use."""
+    cores = os.cpu_count() or 1
+    # Cores available per 1080p worth of output for each concurrent stream
+    budget = cores / max(concurrent_streams, 1) / max(output_pixels / PIXELS_1080P, 0.25)
+    if budget >= 16:
+        index = PRESETS.index('medium')
+    elif budget >= 8:
+        index = PRESETS.index('fast')
+    elif budget >= 4:
+        index = PRESETS.index('faster')
+    elif budget >= 2:
+        index = PRESETS.index('veryfast')
+    elif budget >= 1:
+        index = PRESETS.index('superfast')
+    else:
+        index = PRESETS.index('ultrafast')
+
+    # Step down while the box is already saturated
+    cpu_percent = psutil.cpu_percent(interval=0.5)
+    if cpu_percent >= CPU_SATURATION_PERCENT:
+        index -= 1
+    if cpu_percent >= (100 + CPU_SATURATION_PERCENT) / 2:
+        index -= 1
+    return PRESETS[max(index, 0)]
+
+
+def encoder_args(profile_name, concurrent_streams=None, output_pixels=PIXELS_1080P, include_rates=True,
+                 force_key_frames=None):
+    """Codec options for a profile: preset, threads, GOP, tune and (optionally) rate control.
+
+    `force_key_frames` replaces the profile's fixed GOP, e.g. 'source' to follow the input.
+    """
+    profile = ENCODER_PROFILES[profile_name]
+    if concurrent_streams is None:
+        # This encoder is about to start, so count it as well
+        concurrent_streams = count_running_encoders() + 1
+
+    preset = profile['preset']
+    if preset == 'auto':
+        preset = choose_preset(concurrent_streams, output_pixels)
+    threads = profile['threads']
+    if threads == 'auto':
+        threads = max(1, (os.cpu_count() or 1) // max(concurrent_streams, 1))
+
+    force_key_frames = force_key_frames or f"expr:gte(t,n_forced*{profile['gop_seconds']})"
+    args = ['-preset:v', preset, '-threads', str(threads),
+            '-force_key_frames', force_key_frames, '-sc_threshold', '0']
+    if profile['tune']:
+        args += ['-tune:v', profile['tune']]
+    if include_rates:
+        args += rate_args(profile)
+    print(f"Encoder profile {profile_name}: preset={preset} threads={threads} streams={concurrent_streams}")
+    return args
+
+
+def rate_args(profile, video_bitrate=None, maxrate=None, bufsize=None, stream=None):
+    """Rate control options; explicit values override the profile's own."""
+    suffix = f':v:{stream}' if stream is not None else ':v'
+    video_bitrate = video_bitrate or profile['video_bitrate']
+    maxrate = maxrate or profile['maxrate'] or video_bitrate
+    bufsize = bufsize or profile['bufsize']
+    if not video_bitrate:
+        return []
+
+    args = [f'-b{suffix}', video_bitrate]
+    if profile['rate_control'] == 'cbr':
+        args += [f'-maxrate{suffix}', video_bitrate, f'-minrate{suffix}', video_bitrate]
+    else:
+        args += [f'-maxrate{suffix}', maxrate]
+    if bufsize:
+        args += [f'-bufsize{suffix}', bufsize]
+    return args
+
+
+def abr_filter_complex(ladder):
+    """Decode once, split into one branch per rendition and scale each branch."""
+    splits = ''.join(f'[v{i}]' for i in range(len(ladder)))
+    scales = '; '.join(
+        f"[v{i}]scale=w={rung['width']}:h={rung['height']}[v{i}out]" for i, rung in enumerate(ladder)
+    )
+    return f"[0:v]split={len(ladder)}{splits}; {scales}"
+
+
+def abr_output_args(ladder, profile_name):
+    """Per-rendition map/codec/bitrate arguments and the matching -var_stream_map."""
+    profile = ENCODER_PROFILES[profile_name]
+    output_pixels = sum(rung['width'] * rung['height'] for rung in ladder)
+    args = ['-filter_complex', abr_filter_complex(ladder)]
+    for i, rung in enumerate(ladder):
+        args += ['-map', f'[v{i}out]', f'-c:v:{i}', 'libx264']
+        args += rate_args(profile, rung['video_bitrate'], rung['maxrate'], rung['bufsize'], stream=i)
+    for i, rung in enumerate(ladder):
+        args += ['-map', '0:a:0', f'-c:a:{i}', 'aac', f'-b:a:{i}', rung['audio_bitrate']]
+    # Preset/threads/GOP from the profile; keyframes land on segment boundaries in every
+    # rendition so players can switch cleanly
+    args += encoder_args(profile_name, output_pixels=output_pixels, include_rates=False)
+    args += [
+        '-ac', '2',
+        '-var_stream_map', ' '.join(f"v:{i},a:{i},name:{rung['name']}" for i, rung in enumerate(ladder)),
+    ]
+    return args
+
+
+def media_prefix(name, run=None):
+    """Prefix of segment, part and init file names. The run token makes them unique per
+    encoder run, so they can be cached as immutable even when a restart reuses the playlist."""
+    return f"{name}_{run}" if run else name
+
+
+def hls_flags(flags, append=False):
+    """-hls_flags value; `append` continues the existing playlist (its media sequence and
+    segment numbers) instead of starting over, with a discontinuity where the new run begins."""
+    return f"{flags}+append_list+discont_start" if append else flags
+
+
+def hls_ladder_command(event_file, date, output_dir, ladder=ABR_LADDER, profile_name=HLS_ENCODER_PROFILE, name=None,
+                       append=False, run=None):
+    """ffmpeg command that plays a concat event file out as a multi-rendition HLS ladder.
+
+    Renditions are written as <date>_<name>_playlist.m3u8 / <date>_<run>_<name>_segment_NNN.ts
+    and listed with their bandwidth in master.m3u8; `name` replaces the date prefix.
+    """
+    name = name or date
+    media = media_prefix(name, run)
+    return [
+        'ffmpeg', '-protocol_whitelist', 'file,crypto,data,https,tls,tcp', '-re', '-f', 'concat', '-safe', '0', '-i', event_file,
+        *abr_output_args(ladder, profile_name),
+        '-f', 'hls', '-hls_time', str(HLS_SEGMENT_SECONDS),
+        '-hls_list_size', '20',
+        '-hls_flags', hls_flags('delete_segments', append),
+        '-hls_delete_threshold', '20',
+        '-hls_segment_type', 'mpegts', '-hls_segment_filename', os.path.join(output_dir, f'{media}_%v_segment_%03d.ts'),
+        '-master_pl_name', 'master.m3u8', os.path.join(output_dir, f'{name}_%v_playlist.m3u8')
+    ]
+
+
+# Fields that must be identical across every file for the concat demuxer to stream-copy them
+STREAM_PARAMETERS = ('video_codec', 'width', 'height', 'pix_fmt', 'fps', 'audio_codec', 'sample_rate', 'channels')
+
+
+def conformance_issues(info, spec=OUTPUT_SPEC):
+    """Reasons a probed asset cannot be stream-copied into the output; empty if it conforms."""
+    if not info:
+        return ['not probed']
+    issues = []
+    for field in ('video_codec', 'pix_fmt', 'audio_codec', 'width', 'height'):
+        if info.get(field) != spec[field]:
+            issues.append(f"{field} {info.get(field)} != {spec[field]}")
+    if not info.get('keyframe_interval') or info['keyframe_interval'] > spec['max_keyframe_interval']:
+        issues.append(f"keyframe interval {info.get('keyframe_interval')} > {spec['max_keyframe_interval']}")
+    return issues
+
+
+def remux_eligible(date):
+    """True if every asset scheduled on `date` (and the blank filler) can be stream-copied."""
+    if REMUX_MODE != 'auto':
+        return False
+
+    schedule = schedule_db.getByQuery({"date": date})
+    file_names = {event['file_name'] for event in (schedule[0]['events'] if schedule else [])}
+    file_names.add(BLANK_VIDEO_PATH)
+
+    parameters = set()
+    for file_name in sorted(file_names):
+        info = get_media_info(file_name)
+        issues = conformance_issues(info)
+        if issues:
+            print(f"Transcoding {date}: {file_name} does not conform ({'; '.join(issues)})")
+            return False
+        parameters.add(tuple(info.get(field) for field in STREAM_PARAMETERS))
+
+    if len(parameters) > 1:
+        print(f"Transcoding {date}: scheduled assets have different stream parameters")
+        return False
+    return True
+
+
+def hls_remux_command(event_file, date, output_dir, ladder=ABR_LADDER, name=None, append=False, run=None):
+    """ffmpeg command that stream-copies a conformant concat event file to HLS.
+
+    Only the top rendition of the ladder is produced, under the same names the ladder uses.
+    """
+    name = name or date
+    media = media_prefix(name, run)
+    return [
+        'ffmpeg', '-protocol_whitelist', 'file,crypto,data,https,tls,tcp', '-re', '-f', 'concat', '-safe', '0', '-i', event_file,
+        '-map', '0:v:0', '-map', '0:a:0', '-c', 'copy',
+        '-var_stream_map', f"v:0,a:0,name:{ladder[0]['name']}",
+        '-f', 'hls', '-hls_time', str(HLS_SEGMENT_SECONDS),
+        '-hls_list_size', '20',
+        '-hls_flags', hls_flags('delete_segments', append),
+        '-hls_delete_threshold', '20',
+        '-hls_segment_type', 'mpegts', '-hls_segment_filename', os.path.join(output_dir, f'{media}_%v_segment_%03d.ts'),
+        '-master_pl_name', 'master.m3u8', os.path.join(output_dir, f'{name}_%v_playlist.m3u8')
+    ]
+
+
+def hls_low_latency_command(event_file, date, output_dir, ladder=ABR_LADDER, profile_name=LOW_LATENCY_ENCODER_PROFILE,
+                            name=None, append=False, run=None):
+    """ffmpeg command that encodes the ladder into short fMP4 parts for low-latency HLS.
+
+    ffmpeg's HLS muxer has no notion of parts, so each of its segments is one part
+    (<date>_<run>_<name>_part_NNNNN.m4s) and low_latency.py groups them into full segments and
+    adds EXT-X-PART / EXT-X-PRELOAD-HINT when the playlist is served.
+    """
+    name = name or date
+    media = media_prefix(name, run)
+    return [
+        'ffmpeg', '-protocol_whitelist', 'file,crypto,data,https,tls,tcp', '-re', '-f', 'concat', '-safe', '0', '-i', event_file,
+        *abr_output_args(ladder, profile_name),
+        '-f', 'hls', '-hls_time', str(LOW_LATENCY_PART_SECONDS),
+        '-hls_list_size', str(LOW_LATENCY_PARTS_PER_SEGMENT * 8),
+        # temp_file: a part only appears under its final name once it is complete
+        '-hls_flags', hls_flags('delete_segments+temp_file+independent_segments', append),
+        '-hls_delete_threshold', str(LOW_LATENCY_PARTS_PER_SEGMENT * 4),
+        '-hls_segment_type', 'fmp4', '-hls_fmp4_init_filename', f'{media}_%v_init.mp4',
+        '-hls_segment_filename', os.path.join(output_dir, f'{media}_%v_part_%05d.m4s'),
+        '-master_pl_name', 'master.m3u8', os.path.join(output_dir, f'{name}_%v_playlist.m3u8')
+    ]
+
+
+def hls_playout_command(event_file, date, output_dir, latency_mode='standard', playout_mode='daily'):
+    """Stream-copy the day when every asset conforms to OUTPUT_SPEC, otherwise transcode the ladder.
+
+    Low-latency mode always transcodes, since parts need keyframes more often than the assets have them.
+    Continuous playout writes under CONTINUOUS_OUTPUT_NAME and appends to the existing playlists,
+    so a re-root or restart continues the media sequence.
+    """
+    continuous = playout_mode == 'continuous'
+    name = CONTINUOUS_OUTPUT_NAME if continuous else None
+    run = f"{int(time.time()):x}"
+    if latency_mode == 'low':
+        return hls_low_latency_command(event_file, date, output_dir, name=name, append=continuous, run=run)
+    if uses_stream_copy(date, latency_mode, playout_mode):
+        print(f"All assets for {date} conform to the output spec, remuxing without transcoding")
+        return hls_remux_command(event_file, date, output_dir, name=name, append=continuous, run=run)
+    return hls_ladder_command(event_file, date, output_dir, name=name, append=continuous, run=run)
+
+
+def uses_stream_copy(date, latency_mode='standard', playout_mode='daily', ladder=ABR_LADDER):
+    """Whether hls_playout_command stream-copies the day instead of transcoding it.
+
+    Continuous playout runs one encoder per day (it is re-rooted at midnight), so the day is
+    checked on its own; the copy only has the top rendition, so it is used there only when the
+    ladder has no other renditions the live master playlist would lose.
+    """
+    if latency_mode == 'low' or (playout_mode == 'continuous' and len(ladder) > 1):
+        return False
+    return remux_eligible(date)
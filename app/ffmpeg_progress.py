@@ -0,0 +1,102 @@
+import re
+import time
+import threading
+from collections import deque
+from .config import PROGRESS_HISTORY_SIZE, FFMPEG_LOG_HISTORY_SIZE, PROGRESS_MIN_SPEED, PROGRESS_SLOW_SAMPLES
+
+# Structured progress for supervised ffmpeg jobs. ffmpeg writes key=value blocks to stdout
+# with -progress pipe:1; a reader thread per job parses each block into a sample kept in a
+# ring buffer, and stderr is drained into a short ring of log lines instead of being printed.
+
+NUMBER = re.compile(r'[-+]?\d+(\.\d+)?')
+
+
+def with_progress(command):
+    """The ffmpeg command with progress on stdout and the per-frame stats line on stderr disabled."""
+    return [command[0], '-progress', 'pipe:1', '-nostats', *command[1:]]
+
+
+def _number(value):
+    match = NUMBER.search(value or '')
+    return float(match.group()) if match else None
+
+
+def parse_block(fields):
+    """One -progress block (dict of raw strings) as a sample of typed metrics."""
+    out_time_us = fields.get('out_time_us') or fields.get('out_time_ms')
+    return {
+        'time': time.time(),
+        'frame': int(fields['frame']) if fields.get('frame', '').isdigit() else None,
+        'fps': _number(fields.get('fps')),
+        'bitrate_kbps': _number(fields.get('bitrate')),
+        'total_size': int(fields['total_size']) if fields.get('total_size', '').isdigit() else None,
+        'out_time': int(out_time_us) / 1e6 if out_time_us and out_time_us.lstrip('-').isdigit() else None,
+        'dup_frames': int(fields.get('dup_frames') or 0),
+        'drop_frames': int(fields.get('drop_frames') or 0),
+        'speed': _number(fields.get('speed')),
+        'progress': fields.get('progress'),
+    }
+
+
+class ProgressTracker:
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.samples = deque(maxlen=PROGRESS_HISTORY_SIZE)
+        self.log = deque(maxlen=FFMPEG_LOG_HISTORY_SIZE)
+        self.slow_samples = 0
+        self.runs = 0
+        self.lock = threading.Lock()
+
+    def attach(self, process):
+        """Start draining a freshly spawned process's stdout (progress) and stderr (log)."""
+        with self.lock:
+            self.runs += 1
+            self.slow_samples = 0
+        threading.Thread(target=self._read_progress, args=(process.stdout,),
+                         name=f'progress-{self.job_id}', daemon=True).start()
+        threading.Thread(target=self._read_log, args=(process.stderr,),
+                         name=f'log-{self.job_id}', daemon=True).start()
+
+    def _read_progress(self, stream):
+        fields = {}
+        for line in stream:
+            key, _, value = line.strip().partition('=')
+            fields[key] = value.strip()
+            # 'progress' closes each block
+            if key == 'progress':
+                self._add(parse_block(fields))
+                fields = {}
+        stream.close()
+
+    def _read_log(self, stream):
+        for line in stream:
+            self.log.append(line.rstrip())
+        stream.close()
+
+    def _add(self, sample):
+        sample['run'] = self.runs
+        with self.lock:
+            self.samples.append(sample)
+            if sample['speed'] is not None and sample['speed'] < PROGRESS_MIN_SPEED:
+                self.slow_samples += 1
+                if self.slow_samples == PROGRESS_SLOW_SAMPLES:
+                    print(f"Job {self.job_id} is encoding below realtime (speed {sample['speed']}x)")
+            else:
+                self.slow_samples = 0
+
+    def latest(self):
+        with self.lock:
+            sample = self.samples[-1] if self.samples else None
+            return dict(sample, below_realtime=self.slow_samples >= PROGRESS_SLOW_SAMPLES) if sample else None
+
+    def history(self, limit=None):
+        with self.lock:
+            samples = list(self.samples)
+        return samples[-limit:] if limit else samples
+
+    def to_dict(self, limit=None, log_lines=50):
+        return {
+            'latest': self.latest(),
+            'history': self.history(limit),
+            'log': list(self.log)[-log_lines:],
+        }
@@ -2,10 +2,11 @@ import requests
 from flask import jsonify
 import os
 from .hls_service import start_fetcher
+from .config import HLS_LATENCY_MODE, FFMPEG_SERVICE_BASE_URL
 
-FFMPEG_SERVICE_URL = "http://video_ffmpeg_service:5001/ffmpeg/start"
+FFMPEG_SERVICE_URL = f"{FFMPEG_SERVICE_BASE_URL}/ffmpeg/start"
 
-def start_ffmpeg_service(current_date):
+def start_ffmpeg_service(current_date, latency_mode=HLS_LATENCY_MODE):
     try:
        
         event_file = os.path.abspath(f"event_files/{current_date}.txt")  # Absolute path
@@ -17,7 +18,8 @@ def start_ffmpeg_service(current_date):
         data = {
             "date": current_date,
             "event_file": event_file,
-            "output_video_dir": output_video_dir
+            "output_video_dir": output_video_dir,
+            "latency_mode": latency_mode
         }
 
         # Make a request to the FFmpeg service
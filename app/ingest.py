@@ -0,0 +1,139 @@
+import time
+import uuid
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from .config import (s3_client, BUCKET_NAME, upload_video_folder, INGEST_MAX_WORKERS, INGEST_UPLOAD_TIMEOUT_SECONDS,
+                     INGEST_JOB_TTL_SECONDS)
+from .databases import metadata_db, add_metadata
+from .media_probe import probe_asset
+from .segment_library import queue_library_build
+
+# Bulk ingest jobs: one watcher thread polls S3 for the uploads that are still expected, and
+# each one that lands is probed and registered on a bounded pool, so request workers never
+# block on ffprobe and pool workers never wait for a client. Completed jobs are dropped
+# after INGEST_JOB_TTL_SECONDS.
+
+UPLOAD_POLL_SECONDS = 5
+
+executor = ThreadPoolExecutor(max_workers=INGEST_MAX_WORKERS, thread_name_prefix='ingest')
+jobs = {}
+jobs_lock = threading.Lock()
+# (job_id, file_name) -> (key, deadline) of uploads that have not landed yet
+_waiting = {}
+_watcher = None
+
+
+def _set_item(job_id, file_name, **fields):
+    with jobs_lock:
+        jobs[job_id]['items'][file_name].update(fields)
+        statuses = [item['status'] for item in jobs[job_id]['items'].values()]
+        if all(status in ('registered', 'exists', 'failed') for status in statuses):
+            jobs[job_id]['status'] = 'completed'
+            jobs[job_id]['completed_at'] = datetime.now().isoformat()
+
+
+def _upload_exists(key):
+    try:
+        s3_client.head_object(Bucket=BUCKET_NAME, Key=key)
+        return True
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return False
+        raise
+
+
+def _prune_jobs():
+    cutoff = (datetime.now() - timedelta(seconds=INGEST_JOB_TTL_SECONDS)).isoformat()
+    with jobs_lock:
+        for job_id in [job_id for job_id, job in jobs.items() if job.get('completed_at', cutoff) < cutoff]:
+            del jobs[job_id]
+
+
+def _watch_uploads():
+    while True:
+        time.sleep(UPLOAD_POLL_SECONDS)
+        with jobs_lock:
+            waiting = list(_waiting.items())
+        for (job_id, file_name), (key, deadline) in waiting:
+            try:
+                landed = _upload_exists(key)
+            except Exception as e:
+                print(f"Error checking upload {key}: {e}")
+                landed = False
+            if landed:
+                with jobs_lock:
+                    _waiting.pop((job_id, file_name), None)
+                executor.submit(_ingest_item, job_id, file_name, key)
+            elif time.time() > deadline:
+                with jobs_lock:
+                    _waiting.pop((job_id, file_name), None)
+                _set_item(job_id, file_name, status='failed',
+                          error=f"Upload did not arrive within {INGEST_UPLOAD_TIMEOUT_SECONDS}s")
+        _prune_jobs()
+
+
+def _ensure_watcher():
+    global _watcher
+    with jobs_lock:
+        if _watcher is None or not _watcher.is_alive():
+            _watcher = threading.Thread(target=_watch_uploads, name='ingest-uploads', daemon=True)
+            _watcher.start()
+
+
+def _ingest_item(job_id, file_name, key):
+    try:
+        _set_item(job_id, file_name, status='probing')
+        etag, info = probe_asset(BUCKET_NAME, key)
+        if add_metadata(key, BUCKET_NAME, info['duration'], etag):
+            queue_library_build(key)
+            _set_item(job_id, file_name, status='registered', duration=info['duration'])
+        else:
+            _set_item(job_id, file_name, status='exists')
+    except Exception as e:
+        print(f"Error ingesting {key}: {e}")
+        _set_item(job_id, file_name, status='failed', error=str(e))
+
+
+def start_bulk_ingest(file_names, generate_url):
+    """Create a job for the given file names and return it with a presigned PUT URL per new file.
+
+    `generate_url` signs a PUT for an S3 key. Names that are already registered are
+    reported as 'exists' and get no URL.
+    """
+    job_id = uuid.uuid4().hex
+    job = {'id': job_id, 'status': 'running', 'created_at': datetime.now().isoformat(), 'items': {}}
+    urls = {}
+    pending = []
+
+    for file_name in dict.fromkeys(file_names):
+        key = f"{upload_video_folder}/{file_name}"
+        if metadata_db.getByQuery({"file_name": key}):
+            job['items'][file_name] = {'key': key, 'status': 'exists'}
+            continue
+        urls[file_name] = generate_url(key)
+        job['items'][file_name] = {'key': key, 'status': 'waiting_upload'}
+        pending.append((file_name, key))
+
+    if not pending:
+        job['status'] = 'completed'
+        job['completed_at'] = job['created_at']
+    deadline = time.time() + INGEST_UPLOAD_TIMEOUT_SECONDS
+    with jobs_lock:
+        jobs[job_id] = job
+        # The watcher hands each item to the pool once its upload has landed
+        for file_name, key in pending:
+            _waiting[(job_id, file_name)] = (key, deadline)
+    _ensure_watcher()
+
+    print(f"Bulk ingest job {job_id} started for {len(pending)} file(s)")
+    return job_id, urls
+
+
+def get_job(job_id):
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is None:
+            return None
+        return {**job, 'items': {name: dict(item) for name, item in job['items'].items()}}
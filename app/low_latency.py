@@ -0,0 +1,174 @@
+import os
+import re
+import math
+import threading
+from .config import LOW_LATENCY_PART_SECONDS, LOW_LATENCY_PARTS_PER_SEGMENT
+from .blocking_reload import add_server_control
+
+# Low-latency HLS on top of ffmpeg's fMP4 output. ffmpeg writes one short fMP4 segment per
+# part; a full segment is LOW_LATENCY_PARTS_PER_SEGMENT consecutive parts, served as the
+# concatenation of their moof/mdat fragments under <prefix>_llseg_N.m4s.
+
+PART_PATTERN = re.compile(r'^(?P<prefix>.+)_part_(?P<number>\d+)\.m4s$')
+SEGMENT_PATTERN = re.compile(r'^(?P<prefix>.+)_llseg_(?P<number>\d+)(?:_(?P<first>\d+)-(?P<last>\d+))?\.m4s$')
+# Parts are listed for this many of the most recent full segments
+PART_LISTED_SEGMENTS = 3
+
+# Playlist key -> {'base': extra segments that left the window, 'extras': {grid number: extra segments}}
+_extra_segments = {}
+_sequence_lock = threading.Lock()
+
+
+def is_part_playlist(text):
+    return '#EXT-X-MAP' in text and '_part_' in text
+
+
+def _parse_parts(text):
+    """Split ffmpeg's playlist into header lines and (number, duration, uri, prefix, discontinuity, map) parts."""
+    header, parts = [], []
+    duration, discontinuity, current_map = None, False, None
+    for line in text.splitlines():
+        if line.startswith('#EXTINF:'):
+            duration = float(line.split(':', 1)[1].split(',')[0])
+        elif line and not line.startswith('#'):
+            match = PART_PATTERN.match(line)
+            if match and duration is not None:
+                parts.append((int(match['number']), duration, line, match['prefix'], discontinuity, current_map))
+                discontinuity = False
+            duration = None
+        elif line.startswith('#EXT-X-DISCONTINUITY') and not line.startswith('#EXT-X-DISCONTINUITY-SEQUENCE'):
+            discontinuity = True
+        elif line.startswith(('#EXT-X-MEDIA-SEQUENCE', '#EXT-X-TARGETDURATION', '#EXT-X-ENDLIST',
+                              '#EXT-X-PROGRAM-DATE-TIME')):
+            continue
+        elif line.startswith('#EXT-X-MAP'):
+            current_map = line
+        elif line:
+            header.append(line)
+    return header, parts, '#EXT-X-ENDLIST' in text
+
+
+def _segments(parts):
+    """Group parts into segments of LOW_LATENCY_PARTS_PER_SEGMENT aligned parts.
+
+    A discontinuity (a new encoder run) closes the segment early and the new run's parts
+    start a segment of their own, so a segment never mixes runs. Returns dicts with the
+    segment's grid `number`, its `parts` and whether it is `complete`.
+    """
+    segments = []
+    for part in parts:
+        number = part[0] // LOW_LATENCY_PARTS_PER_SEGMENT
+        previous = segments[-1] if segments else None
+        if previous and previous['number'] == number and not part[4] and part[3] == previous['parts'][-1][3]:
+            previous['parts'].append(part)
+        else:
+            segments.append({'number': number, 'parts': [part]})
+    for i, segment in enumerate(segments):
+        # Anything written after a segment closes it, so only the newest one can be partial
+        segment['complete'] = (i + 1 < len(segments)
+                               or segment['parts'][-1][0] % LOW_LATENCY_PARTS_PER_SEGMENT == LOW_LATENCY_PARTS_PER_SEGMENT - 1)
+    return segments
+
+
+def _segment_uri(segment):
+    first, last, prefix = segment['parts'][0][0], segment['parts'][-1][0], segment['parts'][0][3]
+    if first % LOW_LATENCY_PARTS_PER_SEGMENT == 0 and last - first == LOW_LATENCY_PARTS_PER_SEGMENT - 1:
+        return f"{prefix}_llseg_{segment['number']}.m4s"
+    # Cut short by a discontinuity: the name lists its parts
+    return f"{prefix}_llseg_{segment['number']}_{first:05d}-{last:05d}.m4s"
+
+
+def _first_sequence(key, segments):
+    """Media sequence number of the first segment.
+
+    Grid numbers are sequence numbers until a discontinuity splits a grid slot in two; every
+    extra segment shifts the later ones by one. The extras are remembered per playlist
+    (`key`) so the numbering holds after the split has left the window.
+    """
+    extras = {}
+    for segment in segments:
+        extras[segment['number']] = extras.get(segment['number'], -1) + 1
+    first = segments[0]['number']
+    with _sequence_lock:
+        state = _extra_segments.setdefault(key, {'base': 0, 'extras': {}}) if key else {'base': 0, 'extras': {}}
+        for number in [number for number in state['extras'] if number < first]:
+            state['base'] += state['extras'].pop(number)
+        for number, extra in extras.items():
+            if extra:
+                state['extras'][number] = max(state['extras'].get(number, 0), extra)
+        # The first segment may be the later half of a split whose earlier half is gone
+        return first + state['base'] + state['extras'].get(first, 0) - extras[first]
+
+
+def render_low_latency_playlist(text, key=None):
+    """Turn ffmpeg's playlist of parts into an LL-HLS playlist of segments and parts.
+
+    `key` identifies the playlist (its path) to keep media sequence numbers stable across
+    discontinuities; see _first_sequence.
+    """
+    header, parts, ended = _parse_parts(text)
+    if not parts:
+        return text
+
+    segments = _segments(parts)
+    # The oldest segment may have lost its first parts to delete_segments
+    if len(segments) > 1 and segments[0]['parts'][0][0] % LOW_LATENCY_PARTS_PER_SEGMENT and not segments[0]['parts'][0][4]:
+        segments = segments[1:]
+    complete = [segment for segment in segments if segment['complete']]
+
+    part_target = max([LOW_LATENCY_PART_SECONDS] + [part[1] for part in parts])
+    for segment in segments:
+        segment['duration'] = sum(part[1] for part in segment['parts'])
+    target_duration = math.ceil(max([segment['duration'] for segment in complete]
+                                    + [part_target * LOW_LATENCY_PARTS_PER_SEGMENT]))
+
+    lines = list(header)
+    lines.insert(1, f'#EXT-X-TARGETDURATION:{target_duration}')
+    lines.insert(2, f'#EXT-X-PART-INF:PART-TARGET={part_target:.3f}')
+    lines.append(f'#EXT-X-MEDIA-SEQUENCE:{_first_sequence(key, segments)}')
+
+    listed = complete[-PART_LISTED_SEGMENTS:] + [segment for segment in segments if not segment['complete']]
+    current_map = None
+    for segment in segments:
+        first_part = segment['parts'][0]
+        # Discontinuities and init changes stay in front of the segment they came before
+        if first_part[4]:
+            lines.append('#EXT-X-DISCONTINUITY')
+        if first_part[5] and first_part[5] != current_map:
+            current_map = first_part[5]
+            lines.append(current_map)
+        if any(segment is other for other in listed):
+            for _, duration, uri, _, _, _ in segment['parts']:
+                lines.append(f'#EXT-X-PART:DURATION={duration:.3f},URI="{uri}",INDEPENDENT=YES')
+        if segment['complete']:
+            lines.append(f"#EXTINF:{segment['duration']:.6f},")
+            lines.append(_segment_uri(segment))
+
+    if ended:
+        lines.append('#EXT-X-ENDLIST')
+    else:
+        last_number, _, _, prefix, _, _ = parts[-1]
+        lines.append(f'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="{prefix}_part_{last_number + 1:05d}.m4s"')
+    return add_server_control('\n'.join(lines) + '\n', part_target)
+
+
+def segment_part_paths(directory, filename):
+    """Paths of the parts that make up a virtual _llseg_ segment, or None for other files."""
+    match = SEGMENT_PATTERN.match(filename)
+    if match is None:
+        return None
+    if match['first'] is not None:
+        numbers = range(int(match['first']), int(match['last']) + 1)
+    else:
+        first = int(match['number']) * LOW_LATENCY_PARTS_PER_SEGMENT
+        numbers = range(first, first + LOW_LATENCY_PARTS_PER_SEGMENT)
+    return [os.path.join(directory, f"{match['prefix']}_part_{number:05d}.m4s") for number in numbers]
+
+
+def read_segment(paths):
+    """Concatenate the fragments of a segment's parts; raises FileNotFoundError if one is gone."""
+    chunks = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            chunks.append(f.read())
+    return b''.join(chunks)
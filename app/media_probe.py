@@ -0,0 +1,133 @@
+import json
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from .config import s3_client, PROBE_MAX_WORKERS
+from .databases import metadata_db, probe_db
+from .presigned_urls import get_presigned_url
+
+# Media is probed once per distinct content: results are cached by S3 ETag, so re-uploads of
+# identical files and later scheduling / playout decisions never run ffprobe over the network.
+
+KEYFRAME_SAMPLE_SECONDS = 30  # Only the packets of the first seconds are read to find the GOP
+
+
+def get_etag(bucket_name, object_key):
+    response = s3_client.head_object(Bucket=bucket_name, Key=object_key)
+    return response['ETag'].strip('"')
+
+
+def run_ffprobe(url):
+    """Full ffprobe of a URL: format, every stream and the video packets of the first seconds."""
+    result = subprocess.run(
+        [
+            'ffprobe',
+            '-v', 'error',
+            '-read_intervals', f'%+{KEYFRAME_SAMPLE_SECONDS}',
+            '-show_entries', 'format:stream:packet=stream_index,pts_time,flags',
+            '-of', 'json',
+            url
+        ],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    if result.returncode != 0:
+        raise Exception(f"ffprobe error: {result.stderr.decode('utf-8')}")
+    return json.loads(result.stdout)
+
+
+def _frame_rate(value):
+    try:
+        numerator, denominator = value.split('/')
+        return round(float(numerator) / float(denominator), 3) if float(denominator) else None
+    except (AttributeError, ValueError):
+        return None
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def summarize_probe(probe):
+    """Reduce raw ffprobe output to the fields scheduling and playout care about."""
+    streams = probe.get('streams', [])
+    video = next((s for s in streams if s.get('codec_type') == 'video'), {})
+    audio = next((s for s in streams if s.get('codec_type') == 'audio'), {})
+    file_format = probe.get('format', {})
+
+    # Largest distance between keyframes of the video stream in the sampled packets; one long
+    # GOP is enough to break segment boundaries, so the average would hide it
+    keyframe_times = sorted(
+        float(packet['pts_time']) for packet in probe.get('packets', [])
+        if packet.get('stream_index') == video.get('index') and 'K' in packet.get('flags', '')
+        and packet.get('pts_time') not in (None, 'N/A')
+    )
+    keyframe_interval = None
+    if len(keyframe_times) > 1:
+        keyframe_interval = round(max(later - earlier for earlier, later in zip(keyframe_times, keyframe_times[1:])), 3)
+
+    return {
+        'duration': _float(video.get('duration')) or _float(file_format.get('duration')),
+        'format_name': file_format.get('format_name'),
+        'bit_rate': _float(file_format.get('bit_rate')),
+        'video_codec': video.get('codec_name'),
+        'video_profile': video.get('profile'),
+        'width': video.get('width'),
+        'height': video.get('height'),
+        'pix_fmt': video.get('pix_fmt'),
+        'fps': _frame_rate(video.get('avg_frame_rate')),
+        'keyframe_interval': keyframe_interval,
+        'audio_codec': audio.get('codec_name') if audio else None,
+        'sample_rate': _float(audio.get('sample_rate')) if audio else None,
+        'channels': audio.get('channels') if audio else None,
+        'channel_layout': audio.get('channel_layout') if audio else None,
+    }
+
+
+def probe_asset(bucket_name, object_key):
+    """Return (etag, info) for an S3 object, probing only if its content was never seen."""
+    etag = get_etag(bucket_name, object_key)
+    cached = probe_db.get(etag)
+    if cached:
+        print(f"Probe cache hit for {object_key} ({etag})")
+        return etag, cached['info']
+
+    url = get_presigned_url('get_object', bucket_name, object_key)
+    print(f"Probing video at URL: {url}")
+    probe = run_ffprobe(url)
+    info = summarize_probe(probe)
+    probe_db.put(etag, info, probe)
+    return etag, info
+
+
+def get_media_info(file_name):
+    """Cached probe summary for a registered asset, or None if it was never probed."""
+    cached = probe_db.get_by_file_name(file_name)
+    return cached['info'] if cached else None
+
+
+def _probe_record(record):
+    try:
+        etag, info = probe_asset(record['bucket_name'], record['file_name'])
+        metadata_db.update(record['file_name'], etag=etag, duration=record.get('duration') or info['duration'])
+        return record['file_name'], True
+    except Exception as e:
+        print(f"Error probing {record['file_name']}: {e}")
+        return record['file_name'], False
+
+
+def probe_missing(max_workers=PROBE_MAX_WORKERS):
+    """Probe every registered asset that has no cached probe yet; returns {file_name: ok}."""
+    missing = [
+        record for record in metadata_db.getAll()
+        if not record.get('etag') or probe_db.get(record['etag']) is None
+    ]
+    if not missing:
+        return {}
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = dict(executor.map(_probe_record, missing))
+    print(f"Probed {sum(results.values())}/{len(results)} asset(s) with missing metadata")
+    return results
@@ -0,0 +1,62 @@
+import threading
+from datetime import datetime, timedelta
+from .config import PREFETCH_LEAD_MINUTES, PREFETCH_POLL_SECONDS
+from .databases import schedule_db
+from .asset_cache import prefetch_asset, asset_status
+from .utils import LOCAL_TIMEZONE
+from .rolling_playlist import playing_dates, secure_locking_chunks
+
+# Downloads are driven by the schedule, not by the previous asset finishing: every tick
+# queues the assets whose start_time is less than PREFETCH_LEAD_MINUTES away, then makes sure
+# chunks that lock before the next tick do not reference assets that are still missing.
+
+_status = {}
+_status_lock = threading.Lock()
+
+
+def _event_id(event):
+    return str(event.get('target_id') or f"{event['file_name']}@{event['start_time']}")
+
+
+def prefetch_due_assets(now=None):
+    """Queue downloads for upcoming events inside the look-ahead window and refresh their status."""
+    try:
+        now = now or datetime.now(LOCAL_TIMEZONE)
+        lead = timedelta(minutes=PREFETCH_LEAD_MINUTES)
+
+        # The window can cross midnight into tomorrow's schedule
+        dates = sorted({now.date().isoformat(), (now + lead).date().isoformat()})
+        status = {}
+        for date in dates:
+            schedule = schedule_db.getByQuery({"date": date})
+            events = schedule[0]['events'] if schedule else []
+            for event in events:
+                start_time = LOCAL_TIMEZONE.localize(datetime.fromisoformat(event['start_time']))
+                end_time = LOCAL_TIMEZONE.localize(datetime.fromisoformat(event['end_time']))
+                if end_time < now:
+                    continue
+
+                due_at = start_time - lead
+                if due_at <= now:
+                    prefetch_asset(event['file_name'])
+
+                status[_event_id(event)] = {
+                    'file_name': event['file_name'],
+                    'start_time': event['start_time'],
+                    'due_at': due_at.strftime('%Y-%m-%d %H:%M:%S'),
+                    'status': asset_status(event['file_name']) or 'scheduled'
+                }
+
+        with _status_lock:
+            _status.clear()
+            _status.update(status)
+
+        for date in playing_dates(now):
+            secure_locking_chunks(date, now, PREFETCH_POLL_SECONDS)
+    except Exception as e:
+        print(f"Error prefetching scheduled assets: {e}")
+
+
+def get_prefetch_status():
+    with _status_lock:
+        return {event_id: dict(entry) for event_id, entry in _status.items()}
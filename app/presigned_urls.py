@@ -0,0 +1,67 @@
+import time
+import threading
+from collections import OrderedDict
+from .config import s3_client, PRESIGNED_URL_EXPIRY_SECONDS, PRESIGNED_URL_MIN_REMAINING_SECONDS, PRESIGNED_URL_CACHE_SIZE
+
+# Presigned URLs cached by (operation, bucket, key). A cached URL is handed back while it stays
+# valid for long enough, and re-signed ahead of its expiry. A URL signed with temporary (role
+# or instance-profile) credentials stops working when their session ends, whatever its
+# ExpiresIn says, so it is only considered valid until then.
+
+MAX_EXPIRY_SECONDS = 7 * 24 * 3600  # SigV4 limit
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def _credential_expiry():
+    """Epoch time at which the client's signing credentials expire; None for long-lived keys."""
+    credentials = getattr(getattr(s3_client, '_request_signer', None), '_credentials', None)
+    expiry = getattr(credentials, '_expiry_time', None)
+    return expiry.timestamp() if expiry else None
+
+
+def get_presigned_url(operation, bucket_name, object_key, min_valid_seconds=PRESIGNED_URL_MIN_REMAINING_SECONDS):
+    """Return a presigned URL for `operation` that stays valid for at least `min_valid_seconds`.
+
+    Playlists pass the time until the asset is played (plus its length) as `min_valid_seconds`
+    so a URL can never expire in the middle of playout. Temporary credentials can cut that
+    short; such a URL is cached only until they expire, and re-signed after that.
+    """
+    cache_key = (operation, bucket_name, object_key)
+    now = time.time()
+
+    with _lock:
+        cached = _cache.get(cache_key)
+        if cached and cached[1] - now >= min_valid_seconds:
+            _cache.move_to_end(cache_key)
+            return cached[0]
+
+    expires_in = min(max(PRESIGNED_URL_EXPIRY_SECONDS, int(min_valid_seconds) + PRESIGNED_URL_MIN_REMAINING_SECONDS),
+                     MAX_EXPIRY_SECONDS)
+    url = s3_client.generate_presigned_url(
+        operation,
+        Params={'Bucket': bucket_name, 'Key': object_key},
+        ExpiresIn=expires_in
+    )
+
+    # Read after signing, which refreshes credentials that are about to expire
+    expires_at = now + expires_in
+    credential_expiry = _credential_expiry()
+    if credential_expiry is not None and credential_expiry < expires_at:
+        expires_at = credential_expiry
+        if expires_at - now < min_valid_seconds:
+            print(f"Presigned URL for {object_key} is only valid for {expires_at - now:.0f}s "
+                  f"(credentials expire), {min_valid_seconds:.0f}s requested")
+
+    with _lock:
+        _cache[cache_key] = (url, expires_at)
+        _cache.move_to_end(cache_key)
+        while len(_cache) > PRESIGNED_URL_CACHE_SIZE:
+            _cache.popitem(last=False)
+    return url
+
+
+def clear_presigned_url_cache():
+    with _lock:
+        _cache.clear()
@@ -0,0 +1,236 @@
+import os
+import time
+import signal
+import threading
+import subprocess
+from datetime import datetime
+from .config import (MAX_CONCURRENT_JOBS, RESTART_BACKOFF_INITIAL_SECONDS, RESTART_BACKOFF_MAX_SECONDS,
+                     RESTART_BACKOFF_RESET_SECONDS, PROCESS_STOP_TIMEOUT_SECONDS)
+from .ffmpeg_progress import ProgressTracker, with_progress
+
+# Supervisor for the ffmpeg jobs of every channel on this host. Each job runs in its own
+# process group so stopping it terminates exactly that ffmpeg (and anything it spawned),
+# and is restarted per its policy with exponential backoff.
+
+RESTART_POLICIES = ('always', 'on-failure', 'never')
+ACTIVE_STATES = ('starting', 'running', 'backoff')
+
+
+class JobExistsError(Exception):
+    pass
+
+
+class JobLimitError(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, job_id, command, kind, restart, max_restarts, metadata, progress, on_restart=None,
+                 restart_delay=0):
+        self.id = job_id
+        self.progress = ProgressTracker(job_id) if progress else None
+        self.command = with_progress(command) if progress else command
+        self.kind = kind
+        self.restart = restart
+        self.max_restarts = max_restarts
+        self.metadata = metadata or {}
+        self.on_restart = on_restart
+        self.restart_delay = restart_delay
+        self.state = 'starting'
+        self.process = None
+        self.restarts = 0
+        self.failures = 0
+        self.started_at = None
+        self.last_exit_code = None
+        self.next_restart_at = None
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'state': self.state,
+            'pid': self.process.pid if self.process and self.state == 'running' else None,
+            'restart': self.restart,
+            'restarts': self.restarts,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'last_exit_code': self.last_exit_code,
+            'next_restart_at': self.next_restart_at.isoformat() if self.next_restart_at else None,
+            'command': ' '.join(self.command),
+            'metadata': self.metadata,
+            'progress': self.progress.latest() if self.progress else None,
+        }
+
+
+class ProcessSupervisor:
+    def __init__(self, max_jobs=MAX_CONCURRENT_JOBS):
+        self.max_jobs = max_jobs
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def start(self, job_id, command, kind='ffmpeg', restart='on-failure', max_restarts=None, metadata=None,
+              progress=None, on_restart=None, restart_delay=0):
+        """Start a supervised job; raises JobExistsError or JobLimitError.
+
+        ffmpeg jobs report -progress into a ProgressTracker unless `progress` is False.
+        `on_restart(job)` is called before every restart and may return a new command.
+        `restart_delay` is the wait before restarting an 'always' job after a clean exit.
+        """
+        if restart not in RESTART_POLICIES:
+            raise ValueError(f"restart must be one of {RESTART_POLICIES}")
+        with self.lock:
+            existing = self.jobs.get(job_id)
+            if existing is not None and existing.state in ACTIVE_STATES:
+                raise JobExistsError(f"Job {job_id} is already running")
+            active = sum(1 for job in self.jobs.values() if job.state in ACTIVE_STATES)
+            if active >= self.max_jobs:
+                raise JobLimitError(f"{active} jobs are running, the limit is {self.max_jobs}")
+            if progress is None:
+                progress = 'ffmpeg' in os.path.basename(command[0])
+            job = Job(job_id, command, kind, restart, max_restarts, metadata, progress, on_restart, restart_delay)
+            self.jobs[job_id] = job
+        job.thread = threading.Thread(target=self._supervise, args=(job,), name=f'job-{job_id}', daemon=True)
+        job.thread.start()
+        return job
+
+    def _spawn(self, job):
+        # Both pipes are drained by the tracker's reader threads, so ffmpeg never blocks on them
+        output = subprocess.PIPE if job.progress else subprocess.DEVNULL
+        process = subprocess.Popen(
+            job.command,
+            stdin=subprocess.DEVNULL,
+            stdout=output,
+            stderr=output if job.progress else None,
+            # ffmpeg prints metadata tags as they are, often not UTF-8; a strict decode would
+            # kill a reader thread and leave its pipe undrained
+            encoding='utf-8',
+            errors='replace',
+            # Own process group, so stop() can signal the whole job and nothing else
+            start_new_session=True,
+        )
+        if job.progress:
+            job.progress.attach(process)
+        return process
+
+    def _supervise(self, job):
+        while not job.stop_event.is_set():
+            print(f"Starting job {job.id}: {' '.join(job.command)}")
+            try:
+                job.process = self._spawn(job)
+            except OSError as e:
+                print(f"Job {job.id} failed to start: {e}")
+                job.state = 'failed'
+                return
+            if job.stop_event.is_set():
+                # stop() ran while the process was being spawned
+                self._terminate(job, PROCESS_STOP_TIMEOUT_SECONDS)
+                break
+            job.started_at = datetime.now()
+            job.next_restart_at = None
+            job.state = 'running'
+
+            exit_code = job.process.wait()
+            job.last_exit_code = exit_code
+            if job.stop_event.is_set():
+                break
+
+            ran_for = (datetime.now() - job.started_at).total_seconds()
+            if job.restart == 'never' or (job.restart == 'on-failure' and exit_code == 0):
+                print(f"Job {job.id} exited with code {exit_code}")
+                job.state = 'exited' if exit_code == 0 else 'failed'
+                return
+            if exit_code == 0 and ran_for >= RESTART_BACKOFF_RESET_SECONDS:
+                # A clean exit of an 'always' job after a healthy run is a planned end (e.g. the
+                # end of an event file): it is restarted after restart_delay and does not count
+                # against max_restarts
+                job.failures = 0
+                delay = job.restart_delay
+                print(f"Job {job.id} finished after {ran_for:.0f}s, restarting in {delay:.0f}s")
+            else:
+                # A short clean run (ffmpeg also exits 0 when it rejects an input) is treated
+                # like a crash, so it cannot turn into a tight restart loop
+                if exit_code != 0 and job.max_restarts is not None and job.restarts >= job.max_restarts:
+                    print(f"Job {job.id} exited with code {exit_code}, giving up after {job.restarts} restarts")
+                    job.state = 'failed'
+                    return
+
+                # Back off exponentially while it keeps crashing, start over once a run was healthy
+                job.failures = 1 if ran_for >= RESTART_BACKOFF_RESET_SECONDS else job.failures + 1
+                delay = min(RESTART_BACKOFF_INITIAL_SECONDS * 2 ** (job.failures - 1), RESTART_BACKOFF_MAX_SECONDS)
+                if exit_code == 0:
+                    delay = max(delay, job.restart_delay)
+                print(f"Job {job.id} exited with code {exit_code} after {ran_for:.0f}s, restarting in {delay:.0f}s")
+            job.state = 'backoff'
+            job.next_restart_at = datetime.fromtimestamp(time.time() + delay)
+            if job.stop_event.wait(delay):
+                break
+            job.restarts += 1
+            self._refresh_command(job)
+        job.state = 'stopped'
+        job.next_restart_at = None
+
+    def _refresh_command(self, job):
+        if job.on_restart is None:
+            return
+        try:
+            command = job.on_restart(job)
+        except Exception as e:
+            print(f"Job {job.id} restart hook failed, reusing its command: {e}")
+            return
+        if command:
+            job.command = with_progress(command) if job.progress else command
+
+    def _terminate(self, job, timeout):
+        process = job.process
+        if process is None or process.poll() is not None:
+            return
+        try:
+            os.killpg(process.pid, signal.SIGTERM)
+            process.wait(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            print(f"Job {job.id} did not stop in {timeout}s, killing it")
+            os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+        except ProcessLookupError:
+            pass
+
+    def stop(self, job_id, timeout=PROCESS_STOP_TIMEOUT_SECONDS):
+        """Stop a job and keep it from restarting; returns False if there is no such job."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return False
+        job.stop_event.set()
+        self._terminate(job, timeout)
+        if job.thread is not None and job.thread is not threading.current_thread():
+            job.thread.join(timeout)
+        job.state = 'stopped'
+        print(f"Job {job_id} stopped")
+        return True
+
+    def stop_all(self, kind=None):
+        """Stop every job (of one kind); returns the ids stopped."""
+        with self.lock:
+            job_ids = [job.id for job in self.jobs.values() if kind is None or job.kind == kind]
+        return [job_id for job_id in job_ids if self.stop(job_id)]
+
+    def get(self, job_id):
+        job = self.jobs.get(job_id)
+        return job.to_dict() if job else None
+
+    def get_progress(self, job_id, limit=None):
+        job = self.jobs.get(job_id)
+        if job is None or job.progress is None:
+            return None
+        return job.progress.to_dict(limit)
+
+    def is_active(self, job_id):
+        job = self.jobs.get(job_id)
+        return job is not None and job.state in ACTIVE_STATES
+
+    def list(self, kind=None):
+        return [job.to_dict() for job in list(self.jobs.values()) if kind is None or job.kind == kind]
+
+
+supervisor = ProcessSupervisor()
@@ -0,0 +1,362 @@
+import os
+import math
+import json
+import glob
+import hashlib
+from datetime import datetime, timedelta
+from .config import (EVENT_FILE_DIR, ROLLING_CHUNK_SECONDS, ROLLING_LOCK_MARGIN_SECONDS, DRIFT_MIN_FILLER_SECONDS,
+                     DRIFT_MAX_EXTEND_SECONDS, PLAYOUT_MODE, PREFETCH_POLL_SECONDS)
+from .utils import LOCAL_TIMEZONE, build_event_timeline, timeline_to_lines
+from .asset_cache import unpin_assets, cached_path, is_cached, remote_url
+
+# The root event file (<date>.txt) holds the chunk that was playing when the stream started
+# and ends with a reference to the next chunk file (<date>.partNNNN.txt). Every chunk links to
+# the next grid index, so links never change and only the content of chunks that ffmpeg has
+# not opened yet is rewritten when the schedule changes.
+#
+# Every link opens one more nested concat demuxer, and demuxing gets slower with the depth, so
+# a chain never leaves its day. In continuous playout the next day is written ahead of time
+# (prepare_next_day) with its own root file; at midnight the encoder reaches the end of the
+# chain and is re-rooted on it right away, appending to the same HLS playlists.
+
+
+def part_name(date, index):
+    return f"{date}.part{index:04d}.txt"
+
+
+def manifest_path(date):
+    return os.path.join(EVENT_FILE_DIR, f"{date}.rolling.json")
+
+
+def next_date(date):
+    return (datetime.fromisoformat(date) + timedelta(days=1)).date().isoformat()
+
+
+def playing_dates(now=None):
+    """Dates whose rolling event files are playing or chained to the playing one."""
+    today = (now or datetime.now(LOCAL_TIMEZONE)).date().isoformat()
+    return [today, next_date(today)] if PLAYOUT_MODE == 'continuous' else [today]
+
+
+def chunks_per_day():
+    return int(math.ceil(86400 / ROLLING_CHUNK_SECONDS))
+
+
+def _day_start(date):
+    return LOCAL_TIMEZONE.localize(datetime.fromisoformat(date))
+
+
+def _grid_start(date, index):
+    return _day_start(date) + timedelta(seconds=ROLLING_CHUNK_SECONDS * index)
+
+
+def _chunk_index(date, moment):
+    return int((moment - _day_start(date)).total_seconds() // ROLLING_CHUNK_SECONDS)
+
+
+def chunk_timeline(date, timeline):
+    """Group timeline items by grid chunk, splitting fillers at chunk boundaries.
+
+    Events stay whole in the chunk they start in; fillers are cut so that no filler
+    spans more than one chunk and an edit only ever touches the chunks it falls in.
+    """
+    chunks = {}
+    for item in timeline:
+        if item['kind'] != 'filler':
+            chunks.setdefault(_chunk_index(date, item['start']), []).append(item)
+            continue
+
+        start = item['start']
+        while start < item['end']:
+            index = _chunk_index(date, start)
+            end = min(item['end'], _grid_start(date, index + 1))
+            chunks.setdefault(index, []).append(dict(item, start=start, end=end))
+            start = end
+    return chunks
+
+
+def _link_lines(name):
+    # The linked chunk is opened by a nested concat demuxer, which defaults to safe=1 and
+    # would reject the absolute cache paths and presigned URLs inside it (ffmpeg then just
+    # ends the input with exit code 0)
+    return [f"file '{name}'", 'option safe 0']
+
+
+def _chunk_lines(date, index, items):
+    lines = ['ffconcat version 1.0'] + timeline_to_lines(items)
+    if index + 1 < chunks_per_day():
+        lines += _link_lines(part_name(date, index + 1))
+    return lines
+
+
+def _write_atomic(path, content):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+def _write_chunk(path, lines):
+    """Write a chunk file and return the hash of its content."""
+    content = '\n'.join(lines)
+    _write_atomic(path, content)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def _item_record(item):
+    """What an item will actually play: its scheduled start and its duration.
+
+    Events are trimmed to their compiled slot, so every item plays from start to end.
+    """
+    return {
+        'kind': item['kind'],
+        'file_name': item.get('file_name'),
+        'start': item['start'].isoformat(),
+        'duration': (item['end'] - item['start']).total_seconds()
+    }
+
+
+def _chunk_entry(content_hash, items):
+    # 'end' is where the schedule resumes after the chunk, so a filler extended by drift
+    # correction still counts to its scheduled end; the extra time shifts what follows
+    return {
+        'hash': content_hash,
+        'end': items[-1].get('scheduled_end', items[-1]['end']).isoformat() if items else None,
+        'items': [_item_record(item) for item in items]
+    }
+
+
+def load_manifest(date):
+    try:
+        with open(manifest_path(date), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def _save_manifest(date, manifest):
+    _write_atomic(manifest_path(date), json.dumps(manifest, indent=3))
+
+
+def _chunk_file(date, index, manifest):
+    name = f"{date}.txt" if index == manifest['root_index'] else part_name(date, index)
+    return os.path.join(EVENT_FILE_DIR, name)
+
+
+def _write_day(date, timeline, root_index):
+    """Write the chunks of a date from root_index on and save its manifest.
+
+    The chunk at root_index is the root event file (<date>.txt).
+    """
+    chunks = chunk_timeline(date, timeline)
+    manifest = {
+        'date': date,
+        'chunk_seconds': ROLLING_CHUNK_SECONDS,
+        'start': timeline[0]['start'].isoformat(),
+        'root_index': root_index,
+        'chunks': {}
+    }
+
+    for index in range(root_index, chunks_per_day()):
+        items = chunks.get(index, [])
+        content_hash = _write_chunk(_chunk_file(date, index, manifest), _chunk_lines(date, index, items))
+        manifest['chunks'][str(index)] = _chunk_entry(content_hash, items)
+
+    _save_manifest(date, manifest)
+    return manifest
+
+
+def prepare_next_day(date):
+    """Write the whole day after `date`, from midnight, for the encoder to re-root on.
+
+    Only used in continuous playout. Until the encoder opens it every chunk, the root
+    included, can be patched by regenerate_event_file.
+    """
+    day = next_date(date)
+    try:
+        timeline = build_event_timeline(day, _day_start(day))
+        manifest = _write_day(day, timeline, 0)
+        print(f"Rolling event file prepared for {day}")
+        return manifest
+    except Exception as e:
+        print(f"Error preparing rolling event file for {day}: {e}")
+        return None
+
+
+def write_rolling_event_file(date, current_time=None):
+    """Write the full chained event file for a date, starting at the current time.
+
+    Used when the encoder is (re)started; later edits go through regenerate_event_file.
+    In continuous playout the next day is prepared as well.
+    """
+    try:
+        timeline = build_event_timeline(date, current_time)
+        if not timeline:
+            print(f"Nothing left to play for {date}")
+            return None
+
+        root_index = _chunk_index(date, timeline[0]['start'])
+        manifest = _write_day(date, timeline, root_index)
+        print(f"Rolling event file generated for {date} starting at chunk {root_index}")
+        if PLAYOUT_MODE == 'continuous':
+            prepare_next_day(date)
+        return manifest
+    except Exception as e:
+        print(f"Error generating rolling event file: {e}")
+        return None
+
+
+def reroot_event_file(date, now=None):
+    """Manifest of the root event file to (re)start the encoder on at `now`.
+
+    Right after midnight that is the day prepared ahead of time; otherwise (a crash, or
+    no prepared day) the day is rewritten from the current time.
+    """
+    now = now or datetime.now(LOCAL_TIMEZONE)
+    manifest = load_manifest(date)
+    since_midnight = (now - _day_start(date)).total_seconds()
+    if (manifest and manifest['root_index'] == 0 and 0 <= since_midnight <= ROLLING_LOCK_MARGIN_SECONDS
+            and datetime.fromisoformat(manifest['start']) == _day_start(date)):
+        return manifest
+    return write_rolling_event_file(date)
+
+
+def set_stream_copy(date, stream_copy):
+    """Record whether the encoder playing the date stream-copies it (see encoding.uses_stream_copy)."""
+    manifest = load_manifest(date)
+    if manifest:
+        manifest['stream_copy'] = stream_copy
+        _save_manifest(date, manifest)
+
+
+def secure_locking_chunks(date, now=None, window_seconds=0):
+    """Point chunks that lock within window_seconds at presigned URLs for assets not cached yet.
+
+    Chunks written well ahead reference the cache path of assets that are still downloading.
+    This is the last pass before such a chunk can be opened: any referenced file that is not
+    on disk (download failed or still running, or evicted) is swapped for a URL.
+    Returns the indexes of the rewritten chunks.
+    """
+    manifest = load_manifest(date)
+    if not manifest or manifest.get('chunk_seconds') != ROLLING_CHUNK_SECONDS:
+        return []
+    now = now or datetime.now(LOCAL_TIMEZONE)
+    first = first_mutable_chunk(date, manifest, now)
+    last = first_mutable_chunk(date, manifest, now + timedelta(seconds=window_seconds))
+
+    rewritten = []
+    for index in range(first, min(last + 1, chunks_per_day())):
+        entry = manifest['chunks'].get(str(index))
+        path = _chunk_file(date, index, manifest)
+        if not entry or not os.path.exists(path):
+            continue
+        with open(path, 'r') as f:
+            content = f.read()
+        updated = content
+        for record in entry['items']:
+            local = f"file '{cached_path(record['file_name'])}'" if record['kind'] == 'event' else None
+            if local and local in updated and not is_cached(record['file_name']):
+                ends_in = (datetime.fromisoformat(record['start']) - now).total_seconds() + record['duration']
+                updated = updated.replace(local, f"file '{remote_url(record['file_name'], max(ends_in, 0))}'")
+                print(f"{record['file_name']} is not cached, chunk {index} of {date} plays it from S3")
+        if updated != content:
+            entry['hash'] = _write_chunk(path, updated.split('\n'))
+            rewritten.append(index)
+
+    if rewritten:
+        _save_manifest(date, manifest)
+    return rewritten
+
+
+def first_mutable_chunk(date, manifest, now=None):
+    """Index of the first chunk that is far enough ahead to be rewritten safely."""
+    now = now or datetime.now(LOCAL_TIMEZONE)
+    locked_until = now + timedelta(seconds=ROLLING_LOCK_MARGIN_SECONDS)
+    locked = int(math.ceil((locked_until - _day_start(date)).total_seconds() / ROLLING_CHUNK_SECONDS))
+    if locked_until < datetime.fromisoformat(manifest['start']):
+        # Prepared ahead and not opened yet, so the root chunk can still be rewritten
+        return max(locked, 0)
+    return max(manifest['root_index'] + 1, locked)
+
+
+def _absorb_drift(chunk_items, drift_seconds):
+    """Trim (late) or extend (early) the filler that opens a chunk by the measured drift.
+
+    An extended filler plays longer but keeps its scheduled end (as 'scheduled_end'), so
+    it never reaches past its chunk's grid end in the manifest and everything after it
+    airs that much later instead of being skipped.
+    Returns the correction applied in seconds; 0 when the chunk does not open with a filler.
+    """
+    if not chunk_items or chunk_items[0]['kind'] != 'filler':
+        return 0.0
+    filler = chunk_items[0]
+    length = (filler['end'] - filler['start']).total_seconds()
+    correction = max(min(drift_seconds, length - DRIFT_MIN_FILLER_SECONDS), -DRIFT_MAX_EXTEND_SECONDS)
+    if correction <= 0 < drift_seconds:
+        return 0.0
+    chunk_items[0] = dict(filler, end=filler['end'] - timedelta(seconds=correction))
+    if correction < 0:
+        chunk_items[0]['scheduled_end'] = filler['end']
+    return correction
+
+
+def regenerate_event_file(date, drift_seconds=0.0):
+    """Patch the chunks of a playing rolling event file that ffmpeg has not opened yet.
+
+    Chunks starting within ROLLING_LOCK_MARGIN_SECONDS of now (and everything before)
+    are left alone. The new tail is compiled from the end of the last locked chunk so the
+    running encoder picks it up when it reaches the next chunk reference, with no restart.
+    A non-zero `drift_seconds` (positive when playout runs late) is absorbed by the filler
+    opening the first rewritten chunk.
+    Returns the list of rewritten chunk indexes, or None if no rolling file is playing.
+    """
+    try:
+        manifest = load_manifest(date)
+        if not manifest or manifest.get('chunk_seconds') != ROLLING_CHUNK_SECONDS:
+            print(f"No rolling event file in use for {date}, nothing to patch.")
+            return None
+
+        first_mutable = first_mutable_chunk(date, manifest)
+        if first_mutable >= chunks_per_day():
+            print(f"All chunks for {date} are already playing, nothing to patch.")
+            return []
+
+        # Resume after whatever the locked chunks will actually play
+        anchor = _grid_start(date, first_mutable)
+        for index, entry in manifest['chunks'].items():
+            if int(index) < first_mutable and entry['end']:
+                anchor = max(anchor, datetime.fromisoformat(entry['end']))
+
+        chunks = chunk_timeline(date, build_event_timeline(date, anchor))
+        if drift_seconds:
+            correction = _absorb_drift(chunks.get(first_mutable, []), drift_seconds)
+            print(f"Absorbed {correction:.3f}s of {drift_seconds:.3f}s drift in chunk {first_mutable}")
+        patched = []
+        for index in range(first_mutable, chunks_per_day()):
+            items = chunks.get(index, [])
+            lines = _chunk_lines(date, index, items)
+            content_hash = hashlib.sha1('\n'.join(lines).encode('utf-8')).hexdigest()
+            if manifest['chunks'].get(str(index), {}).get('hash') == content_hash:
+                continue
+            _write_chunk(_chunk_file(date, index, manifest), lines)
+            manifest['chunks'][str(index)] = _chunk_entry(content_hash, items)
+            patched.append(index)
+
+        _save_manifest(date, manifest)
+        # Patched chunks may reference assets that are still downloading
+        secure_locking_chunks(date, window_seconds=PREFETCH_POLL_SECONDS)
+        print(f"Patched {len(patched)} chunk(s) for {date} from {anchor}: {patched}")
+        return patched
+    except Exception as e:
+        print(f"Error regenerating event file: {e}")
+        return None
+
+
+def remove_rolling_event_files(date):
+    """Delete the event file, chunk files and manifest for a date."""
+    paths = [os.path.join(EVENT_FILE_DIR, f"{date}.txt"), manifest_path(date)]
+    paths += glob.glob(os.path.join(EVENT_FILE_DIR, f"{date}.part*.txt"))
+    for path in paths:
+        if os.path.exists(path):
+            os.remove(path)
+    unpin_assets(date)
@@ -1,18 +1,30 @@
-from flask import Blueprint, request, jsonify,send_from_directory
+from flask import Blueprint, request, jsonify,send_from_directory, Response
 from datetime import datetime, timedelta
 #from video_scheduler_backend.app.scheduler import schedule_stream_job
-from .databases import metadata_db, schedule_db
-from .utils import generate_event_file, get_video_duration_from_s3, generate_presigned_url_func, add_metadata
-from .config import s3_client, BUCKET_NAME,upload_video_folder
+from .databases import metadata_db, schedule_db, add_metadata
+from .utils import generate_presigned_url_func
+from .config import s3_client, BUCKET_NAME,upload_video_folder, RTMP_ENCODER_PROFILE, HLS_LATENCY_MODE, LATENCY_MODES, \
+    RTMP_RESTART_DELAY_SECONDS, S3_CLEANUP_ALLOWED_PREFIXES
+from .encoding import encoder_args, remux_eligible
 import ffmpeg
 import os
 import urllib.parse
 from .ffmpeg_service import start_ffmpeg_service
+from .rolling_playlist import write_rolling_event_file, regenerate_event_file, playing_dates, load_manifest
+from .media_probe import probe_asset, probe_missing, get_media_info
+from .ingest import start_bulk_ingest, get_job
+from .prefetch_scheduler import get_prefetch_status
+from .drift_monitor import get_drift_status
+from .s3_cleanup import cleanup_prefix
+from .segment_library import queue_library_build
+from .databases import library_db
+from .stitcher import stitched_playlist, StitchError, invalidate as invalidate_stitched
+from .segment_server import serve_output_file
+from .schedule_compiler import get_compiled_schedule
+from .auto_scheduler import auto_schedule
+from .process_manager import supervisor, JobExistsError, JobLimitError, ACTIVE_STATES
 import json
 import pytz
-import subprocess
-import threading
-import time
 
 routes = Blueprint('routes', __name__)
 # Path to the JSON file
@@ -33,7 +45,6 @@ if not os.path.exists(OUTPUT_VIDEOS_DIR):
 # Path to your video files
 VIDEO_FOLDER = os.path.join(os.getcwd(), "event_files", "content-scheduler", "uploaded_videos")
 UPLOAD_FOLDER = 'uploads'
-processes = {}
 
 if not os.path.exists(UPLOAD_FOLDER):
     os.makedirs(UPLOAD_FOLDER)
@@ -74,38 +85,6 @@ def save_stream_data(data):
     with open(STREAM_DB_FILE, "w") as file:
         json.dump(data, file, indent=4)  # 🔹 Save back to file
 
-def ffmpeg_runner(ffmpeg_cmd, stream_id):
-    """ Runs FFmpeg in a loop, restarting if it fails, unless stopped """
-    while stream_status.get('is_streaming', False):  # ✅ Check if streaming is active
-        print(f"Starting FFmpeg for stream {stream_id} with command:\n{' '.join(ffmpeg_cmd)}")
-
-        try:
-            process = subprocess.Popen(
-                ffmpeg_cmd, 
-                stdout=subprocess.PIPE, 
-                stderr=subprocess.PIPE, 
-                text=True
-            )
-
-            processes[stream_id] = process  # ✅ Store process reference
-
-            # ✅ Read FFmpeg logs in real-time
-            for line in process.stderr:
-                print(line, end="")  # Print FFmpeg logs in real-time
-
-            stdout, stderr = process.communicate()  # ✅ Wait for process to exit
-
-            if not stream_status.get('is_streaming', False):  # ✅ Exit loop if stopped
-                print(f"❌ Stream {stream_id} stopped manually.")
-                break
-
-            print(f"⚠️ Stream {stream_id} crashed! Restarting in 5 seconds...")
-            time.sleep(5)  # ✅ Wait before restarting
-
-        except Exception as e:
-            print(f"🚨 Error running FFmpeg: {e}")
-            break  # ✅ Exit loop on critical failure
-
 @routes.route('/start-stream', methods=['POST'])
 def start_stream():
     data = request.json  # ✅ Get request data
@@ -133,14 +112,14 @@ def start_stream():
     output_urls = [stream["url"] for stream in streams if "url" in stream]
  
     # Check if this stream is already running
-    if stream_id in processes:
+    if supervisor.is_active(stream_id):
         return jsonify({"error": f"Streams with ID {stream_id} are already running."}), 400
  
     # Build the FFmpeg command
     ffmpeg_cmd = [
         "/usr/bin/ffmpeg", "-re", "-i", input_url,
         "-reconnect", "1", "-reconnect_streamed", "1", "-reconnect_delay_max", "5",
-        "-c:v", "libx264", "-preset", "veryfast", "-b:v", "750K", "-maxrate", "750K", "-bufsize", "1500K",
+        "-c:v", "libx264", *encoder_args(RTMP_ENCODER_PROFILE),
         "-c:a", "aac", "-b:a", "96K", "-ar", "44100"
     ]
     
@@ -150,12 +129,14 @@ def start_stream():
     
     print(f"Constructed FFmpeg command: {' '.join(ffmpeg_cmd)}")  # ✅ Debugging
     
-    # Start the FFmpeg runner in a new thread so it can restart on failures
-    ffmpeg_thread = threading.Thread(target=ffmpeg_runner, args=(ffmpeg_cmd, stream_id), daemon=True)
-    ffmpeg_thread.start()
-    
-    # Store the thread object for later control/termination if needed
-    processes[stream_id] = ffmpeg_thread
+    # The supervisor restarts the relay with backoff until it is stopped
+    try:
+        supervisor.start(stream_id, ffmpeg_cmd, kind='rtmp', restart='always', metadata={'outputs': output_urls},
+                         restart_delay=RTMP_RESTART_DELAY_SECONDS)
+    except JobLimitError as e:
+        return jsonify({"error": str(e)}), 503
+    except JobExistsError as e:
+        return jsonify({"error": str(e)}), 400
  
     # Prepare response data for active streams
     active_processes = [{
@@ -185,15 +166,14 @@ def start_stream():
 
 @routes.route("/stop-stream", methods=["POST"])
 def stop_stream():
-    # Terminate all active streaming processes
-    for stream_id, process in list(processes.items()):
-        try:
-            process.terminate()           # Attempt graceful termination
-            process.wait(timeout=10)      # Wait up to 10 seconds for exit
-        except Exception as e:
-            process.kill()                # Force kill if needed
-        # Remove the process from the dictionary
-        processes.pop(stream_id, None)
+    # Terminate one stream if streamDataId is given, otherwise every RTMP stream
+    stream_id = (request.get_json(silent=True) or {}).get("streamDataId")
+    if stream_id is not None:
+        supervisor.stop(stream_id)
+    else:
+        supervisor.stop_all(kind='rtmp')
+    if any(job['state'] in ACTIVE_STATES for job in supervisor.list(kind='rtmp')):
+        return jsonify({"message": f"Stream {stream_id} stopped", "is_streaming": True})
     
     # Remove the persisted record from the JSON DB by overwriting the file with an empty list
     if os.path.exists(STREAM_DB_FILE):
@@ -207,6 +187,33 @@ def stop_stream():
     stream_status["is_streaming"] = False
     return jsonify({"message": "Stream stopped", "is_streaming": False})
 
+@routes.route('/processes', methods=['GET'])
+def list_processes():
+    # ?kind=rtmp|hls narrows the list
+    return jsonify(supervisor.list(kind=request.args.get('kind'))), 200
+
+@routes.route('/processes/<job_id>', methods=['GET'])
+def get_process(job_id):
+    job = supervisor.get(job_id)
+    if job is None:
+        return jsonify({'error': f'No process {job_id}'}), 404
+    return jsonify(job), 200
+
+@routes.route('/processes/<job_id>/progress', methods=['GET'])
+def process_progress(job_id):
+    # fps, speed, bitrate, dropped/duplicated frames and out_time per -progress sample
+    limit = request.args.get('limit', type=int)
+    progress = supervisor.get_progress(job_id, limit)
+    if progress is None:
+        return jsonify({'error': f'No progress for process {job_id}'}), 404
+    return jsonify(progress), 200
+
+@routes.route('/processes/<job_id>/stop', methods=['POST'])
+def stop_process(job_id):
+    if not supervisor.stop(job_id):
+        return jsonify({'error': f'No process {job_id}'}), 404
+    return jsonify(supervisor.get(job_id)), 200
+
 @routes.route("/get_stream_data", methods=["GET"])
 def get_stream_data():
     if os.path.exists(STREAM_DB_FILE):
@@ -238,7 +245,16 @@ def get_stream_status():
 @routes.route("/output_videos/<path:filename>", methods=["GET"])
 def serve_video(filename):
     try:
-        return send_from_directory(OUTPUT_VIDEOS_DIR, filename)
+        # stitched_*.m3u8 playlists are generated from the schedule on every request
+        try:
+            playlist = stitched_playlist(filename)
+        except StitchError as e:
+            return {"error": str(e)}, 503
+        if playlist is not None:
+            return Response(playlist, mimetype='application/vnd.apple.mpegurl',
+                            headers={'Cache-Control': 'no-cache'})
+
+        return serve_output_file(OUTPUT_VIDEOS_DIR, filename)
     except FileNotFoundError:
         return {"error": "File not found"}, 404
 
@@ -270,17 +286,26 @@ def add_metadata_api():
         file_name = data.get('file_name')
         bucket_name = BUCKET_NAME
         key= f"{upload_video_folder}/{file_name}"
-        
-        duration = get_video_duration_from_s3(bucket_name, key)
 
         # Validate input data
         if not file_name or not bucket_name:
             return jsonify({'error': 'Missing required fields'}), 400
-        
+
+        # Probe once per distinct content; identical re-uploads hit the cache
+        try:
+            etag, info = probe_asset(bucket_name, key)
+            duration = info['duration']
+        except Exception as e:
+            print(f"Error probing {key}: {e}")
+            etag, duration = None, None
+
         # Add metadata to the database
-        result = add_metadata(key, bucket_name, duration )
+        result = add_metadata(key, bucket_name, duration, etag)
 
         if result:
+            # Encode once into the pre-segmented library, off the request path
+            if etag:
+                queue_library_build(key)
             return jsonify({'message': 'Metadata added successfully'}), 200
         else:
             return jsonify({'message': 'Metadata already exists'}), 409
@@ -288,6 +313,97 @@ def add_metadata_api():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
     
+@routes.route('/bulk-ingest', methods=['POST'])
+def bulk_ingest_api():
+    try:
+        file_names = request.json.get('file_names', [])
+        if not file_names:
+            return jsonify({'error': 'file_names is required'}), 400
+
+        # One response with every upload URL; probing and registration run in the background
+        job_id, urls = start_bulk_ingest(file_names, generate_presigned_url_func)
+        return jsonify({'job_id': job_id, 'urls': urls}), 202
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@routes.route('/bulk-ingest/<job_id>', methods=['GET'])
+def bulk_ingest_status(job_id):
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': f'Job {job_id} not found'}), 404
+    return jsonify(job), 200
+
+
+@routes.route('/s3-cleanup', methods=['POST'])
+def s3_cleanup_api():
+    try:
+        data = request.json or {}
+        prefix = data.get('prefix', 'hls/')
+        if not isinstance(prefix, str) or not prefix.startswith(S3_CLEANUP_ALLOWED_PREFIXES):
+            return jsonify({'error': f"prefix must start with one of {', '.join(S3_CLEANUP_ALLOWED_PREFIXES)}"}), 400
+
+        older_than = None
+        if data.get('older_than_seconds') is not None:
+            older_than = datetime.now(pytz.utc) - timedelta(seconds=int(data['older_than_seconds']))
+
+        result = cleanup_prefix(BUCKET_NAME, prefix, pattern=data.get('pattern'),
+                                older_than=older_than, dry_run=bool(data.get('dry_run', True)))
+        return jsonify(result), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@routes.route('/asset-library', methods=['GET'])
+def asset_library_api():
+    # Status of every pre-segmented asset, without the segment lists
+    entries = [{key: value for key, value in entry.items() if key != 'renditions'} for entry in library_db.getAll()]
+    return jsonify(entries), 200
+
+
+@routes.route('/asset-library/build', methods=['POST'])
+def asset_library_build_api():
+    file_name = (request.json or {}).get('file_name')
+    if not file_name:
+        return jsonify({'error': 'file_name is required'}), 400
+    status = queue_library_build(file_name)
+    if status is None:
+        return jsonify({'error': f'No probe data for {file_name}'}), 404
+    return jsonify({'file_name': file_name, 'status': status}), 202
+
+
+@routes.route('/prefetch-status', methods=['GET'])
+def prefetch_status_api():
+    return jsonify(get_prefetch_status()), 200
+
+
+@routes.route('/drift', methods=['GET'])
+def drift_api():
+    # Latest playout drift of the HLS channel; ?history=true adds the recent measurements
+    return jsonify(get_drift_status(request.args.get('history') == 'true')), 200
+
+@routes.route('/probe-missing', methods=['POST'])
+def probe_missing_api():
+    try:
+        # Fill in probe results for every asset that has none yet
+        results = probe_missing()
+        return jsonify({'probed': [name for name, ok in results.items() if ok],
+                        'failed': [name for name, ok in results.items() if not ok]}), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+@routes.route('/media-info', methods=['GET'])
+def media_info_api():
+    file_name = request.args.get('file_name')
+    if not file_name:
+        return jsonify({'error': 'file_name is required'}), 400
+
+    info = get_media_info(file_name)
+    if info is None:
+        return jsonify({'error': f'No probe data for {file_name}'}), 404
+    return jsonify(info), 200
+
 @routes.route('/schedule-video', methods=['POST'])
 def schedule_video():
     try:
@@ -314,85 +430,37 @@ def schedule_video():
         print(f"Selected Date: {selected_date}")
         print(f"Videos: {videos}")
 
-        # Initialize schedule_db with default structure
-        schedule_db = {'data': []}
-
-        # Try to read existing schedule from schedule_db.json
-        try:
-            with open('schedule_db.json', 'r') as f:
-                file_content = f.read().strip()
-                if file_content:  # Only try to load if file is not empty
-                    schedule_db = json.loads(file_content)
-        except FileNotFoundError:
-            # File doesn't exist, we'll create it with default structure
-            pass
-        except json.JSONDecodeError:
-            # File exists but is empty or invalid, use default structure
-            pass
-
-        # Ensure the structure of the schedule_db
-        if 'data' not in schedule_db:
-            schedule_db['data'] = []
-
-        # Generate a random ID for new entries
-        import random
-        new_id = random.randint(100000000000000000, 999999999999999999)
-
         # If no videos are provided, remove the entire entry for the selected date
         if not videos:
-            schedule_db['data'] = [entry for entry in schedule_db['data'] 
-                                 if entry['date'] != selected_date]
+            schedule_db.delete_day(selected_date)
         else:
-            # Process videos if they exist
-            schedule_found = False
-            for entry in schedule_db['data']:
-                if entry['date'] == selected_date:
-                    # If the date matches, update the events
-                    entry['events'] = []  # Clear existing events for this date
-                    for video in videos:
-                        start_time = datetime.fromisoformat(video['start_time'].replace('T', ' '))
-                        end_time = start_time + timedelta(seconds=video['duration'])
-                        entry['events'].append({
-                            'target_id': video['target_id'],
-                            'file_name': urllib.parse.unquote(video['file_name']),
-                            'start_time': start_time.strftime("%Y-%m-%d %H:%M:%S"),
-                            'end_time': end_time.strftime("%Y-%m-%d %H:%M:%S"),
-                            'color': video.get('color', '#10b981'),
-                        })
-                    # Ensure ID exists
-                    if 'id' not in entry:
-                        entry['id'] = new_id
-                    schedule_found = True
-                    break
-
-            # If no matching date is found and we have videos, add a new entry
-            if not schedule_found and videos:
-                new_entry = {
-                    'date': selected_date,
-                    'events': [],
-                    'id': new_id
-                }
-                
-                for video in videos:
-                    start_time = datetime.fromisoformat(video['start_time'].replace('T', ' '))
-                    end_time = start_time + timedelta(seconds=video['duration'])
-                    new_entry['events'].append({
-                        'target_id': video['target_id'],
-                        'file_name': urllib.parse.unquote(video['file_name']),
-                        'start_time': start_time.strftime("%Y-%m-%d %H:%M:%S"),
-                        'end_time': end_time.strftime("%Y-%m-%d %H:%M:%S"),
-                        'color': video.get('color', '#10b981'),
-                    })
-                schedule_db['data'].append(new_entry)
-
-        # Sort the data array by date
-        schedule_db['data'].sort(key=lambda x: datetime.strptime(x['date'], '%Y-%m-%d'))
-
-        # Write the updated schedule back to schedule_db.json
-        with open('schedule_db.json', 'w') as f:
-            json.dump(schedule_db, f, indent=3)
-
-        return jsonify({'message': 'Schedule updated successfully.'})
+            events = []
+            for video in videos:
+                start_time = datetime.fromisoformat(video['start_time'].replace('T', ' '))
+                end_time = start_time + timedelta(seconds=video['duration'])
+                events.append({
+                    'target_id': video['target_id'],
+                    'file_name': urllib.parse.unquote(video['file_name']),
+                    'start_time': start_time.strftime("%Y-%m-%d %H:%M:%S"),
+                    'end_time': end_time.strftime("%Y-%m-%d %H:%M:%S"),
+                    'color': video.get('color', '#10b981'),
+                })
+
+            # Replace only this day's events, atomically
+            schedule_db.upsert_day(selected_date, events)
+
+        # Compile the day once per edit; every playout path reuses the stored timeline
+        compiled = get_compiled_schedule(selected_date)
+
+        # Stitched playlists recompile this day on the next request
+        invalidate_stitched(selected_date)
+
+        # Patch the playing event file in place instead of restarting ffmpeg; in continuous
+        # playout tomorrow is already written and chained to today
+        if selected_date in playing_dates():
+            patch_playout(selected_date)
+
+        return jsonify({'message': 'Schedule updated successfully.', 'warnings': compiled['warnings']})
 
     except Exception as e:
         print(f"Error scheduling video: {e}")
@@ -400,6 +468,58 @@ def schedule_video():
     
 
 
+def patch_playout(date):
+    """Patch the playing event file after an edit, restarting the encoder if it can no longer stream-copy."""
+    regenerate_event_file(date)
+    manifest = load_manifest(date)
+    if manifest and manifest.get('stream_copy') and not remux_eligible(date):
+        # A stream-copy encoder cannot take an asset with other codec, size or GOP
+        print(f"{date} no longer conforms to the output spec, restarting the encoder to transcode")
+        write_rolling_event_file(date)
+        start_ffmpeg_service(date)
+
+
+@routes.route('/auto-schedule', methods=['POST'])
+def auto_schedule_api():
+    # Fill start..end ('YYYY-MM-DD HH:MM:SS') from a pool of {file_name, weight}; the whole
+    # metadata library is the pool when none is given
+    data = request.json or {}
+    try:
+        range_start = datetime.fromisoformat(data['start'])
+        range_end = datetime.fromisoformat(data['end'])
+        days = auto_schedule(
+            range_start, range_end,
+            pool=data.get('pool'),
+            mode=data.get('mode', 'weighted'),
+            gap_seconds=int(data.get('gap_seconds', 0)),
+            no_repeat=int(data.get('no_repeat', 0)),
+            seed=data.get('seed'),
+            replace=data.get('replace', True),
+            dry_run=data.get('dry_run', False)
+        )
+    except KeyError as e:
+        return jsonify({'error': f'Missing field {e}'}), 400
+    except (ValueError, TypeError) as e:
+        return jsonify({'error': str(e)}), 400
+
+    if not data.get('dry_run', False):
+        for date in days:
+            invalidate_stitched(date)
+        for date in playing_dates():
+            if date in days:
+                patch_playout(date)
+
+    response = {'days': {date: len(events) for date, events in days.items()}}
+    if data.get('dry_run', False):
+        response['schedule'] = days
+    return jsonify(response), 200
+
+@routes.route('/compiled-schedule', methods=['GET'])
+def compiled_schedule_api():
+    # Frame-accurate timeline of ?date=YYYY-MM-DD (defaults to today)
+    date = request.args.get('date') or datetime.now(india_tz).date().isoformat()
+    return jsonify(get_compiled_schedule(date)), 200
+
 @routes.route('/fetch-metadata', methods=['GET'])
 def fetch_metadata_json():
     try:
@@ -431,9 +551,13 @@ def fetch_scheduled_events():
 @routes.route('/start-ffmpeg-stream', methods=['GET'])
 def start_ffmpeg_stream():
     try:
+        # ?latency_mode=low selects low-latency HLS for this channel
+        latency_mode = request.args.get('latency_mode', HLS_LATENCY_MODE)
+        if latency_mode not in LATENCY_MODES:
+            return jsonify({'error': f"latency_mode must be one of {', '.join(LATENCY_MODES)}"}), 400
         currentDate = datetime.now(india_tz).date().isoformat()
-        generate_event_file(currentDate)
-        start_ffmpeg_service(currentDate)
+        write_rolling_event_file(currentDate)
+        start_ffmpeg_service(currentDate, latency_mode)
         return jsonify({'message': 'FFmpeg stream started successfully'}), 200
     except Exception as e:
         print(f"Error starting FFmpeg stream: {e}")
@@ -0,0 +1,69 @@
+import fnmatch
+from datetime import timezone
+from concurrent.futures import ThreadPoolExecutor
+from .config import s3_client, S3_CLEANUP_WORKERS
+
+# Prefix cleanup that pages through the whole listing (not just the first 1000 keys) and
+# deletes in 1000-key delete_objects batches, several batches at a time.
+
+DELETE_BATCH_SIZE = 1000  # S3 limit for delete_objects
+
+
+def iter_objects(bucket_name, prefix, client=s3_client):
+    paginator = client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        yield from page.get('Contents', [])
+
+
+def _matches(obj, pattern, older_than, newer_than):
+    if pattern and not (fnmatch.fnmatch(obj['Key'], pattern) or fnmatch.fnmatch(obj['Key'].rsplit('/', 1)[-1], pattern)):
+        return False
+    if older_than and obj['LastModified'] >= older_than:
+        return False
+    if newer_than and obj['LastModified'] <= newer_than:
+        return False
+    return True
+
+
+def _delete_batch(client, bucket_name, keys):
+    response = client.delete_objects(
+        Bucket=bucket_name,
+        Delete={'Objects': [{'Key': key} for key in keys], 'Quiet': True}
+    )
+    return response.get('Errors', [])
+
+
+def cleanup_prefix(bucket_name, prefix, pattern=None, older_than=None, newer_than=None,
+                   dry_run=False, client=s3_client, max_workers=S3_CLEANUP_WORKERS):
+    """Delete the objects under a prefix that match every given predicate.
+
+    `pattern` is a glob matched against the key or its file name, `older_than` / `newer_than`
+    are datetimes compared with LastModified (naive values are taken as UTC). With `dry_run`
+    nothing is deleted and the matching keys are returned.
+    """
+    older_than = _as_utc(older_than)
+    newer_than = _as_utc(newer_than)
+    keys = [
+        obj['Key'] for obj in iter_objects(bucket_name, prefix, client)
+        if _matches(obj, pattern, older_than, newer_than)
+    ]
+    result = {'matched': len(keys), 'deleted': 0, 'errors': []}
+    if dry_run:
+        result['keys'] = keys
+        print(f"Dry run: {len(keys)} object(s) under s3://{bucket_name}/{prefix} would be deleted")
+        return result
+
+    batches = [keys[i:i + DELETE_BATCH_SIZE] for i in range(0, len(keys), DELETE_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for errors in executor.map(lambda batch: _delete_batch(client, bucket_name, batch), batches):
+            result['errors'].extend(errors)
+
+    result['deleted'] = len(keys) - len(result['errors'])
+    print(f"Deleted {result['deleted']} object(s) under s3://{bucket_name}/{prefix} in {len(batches)} batch(es)")
+    return result
+
+
+def _as_utc(moment):
+    if moment is None or moment.tzinfo is not None:
+        return moment
+    return moment.replace(tzinfo=timezone.utc)
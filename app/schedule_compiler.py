@@ -0,0 +1,171 @@
+import json
+import math
+import hashlib
+from fractions import Fraction
+from datetime import datetime, timedelta
+from .config import COMPILER_FRAME_RATE
+from .databases import schedule_db, metadata_db, compiled_schedule_db
+from .media_probe import get_media_info
+
+# Compiles a day's events and the assets' real durations into a frame-accurate timeline that
+# is stored once per edit and reused by every consumer (event files, stitcher, drift monitor).
+# All boundaries are whole frames from the start of the day, so inpoint/outpoint/duration are
+# exact and back-to-back items never gain or lose a fraction of a frame.
+#
+# Overlaps are resolved deterministically: events are ordered by start time, then by their
+# position in the saved schedule. An event starting while the previous one is still playing
+# cuts the previous one at its own start; of two events with the same start the first saved
+# one is kept.
+
+COMPILER_VERSION = 1
+FRAME_RATE = Fraction(COMPILER_FRAME_RATE)
+
+
+def to_frames(seconds, fps=FRAME_RATE):
+    return int(round(Fraction(seconds) * fps))
+
+
+def to_seconds(frames, fps=FRAME_RATE):
+    return float(Fraction(frames) / fps)
+
+
+def _asset_durations(events):
+    """Real duration of each scheduled asset, from its probe or its metadata record."""
+    durations = {}
+    for file_name in sorted({event['file_name'] for event in events}):
+        info = get_media_info(file_name)
+        duration = info.get('duration') if info else None
+        if duration is None:
+            records = metadata_db.getByQuery({"file_name": file_name})
+            duration = records[0]['duration'] if records else None
+        durations[file_name] = duration
+    return durations
+
+
+def source_hash(events, durations, fps=FRAME_RATE):
+    payload = json.dumps({'version': COMPILER_VERSION, 'fps': str(fps), 'events': events, 'durations': durations},
+                         sort_keys=True, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def compile_schedule(date, events, durations, fps=FRAME_RATE):
+    """Validate and resolve a day's events into a gap-free list of event and filler items.
+
+    Items carry start_frame/end_frame from the start of the day, their naive local
+    start/end, and for events the inpoint and duration to play. Problems that were
+    resolved (dropped, trimmed or cut events) are listed in `warnings`.
+    """
+    day_start = datetime.fromisoformat(date)
+    day_frames = to_frames(86400, fps)
+    warnings = []
+
+    candidates = []
+    for position, event in enumerate(events):
+        label = f"{event.get('file_name')} at {event.get('start_time')}"
+        try:
+            start_frame = to_frames((datetime.fromisoformat(event['start_time']) - day_start).total_seconds(), fps)
+            end_frame = to_frames((datetime.fromisoformat(event['end_time']) - day_start).total_seconds(), fps)
+        except (KeyError, TypeError, ValueError) as e:
+            warnings.append(f"{label}: invalid event ({e}), dropped")
+            continue
+
+        if start_frame < 0 or start_frame >= day_frames:
+            warnings.append(f"{label}: starts outside {date}, dropped")
+            continue
+
+        inpoint_frames = to_frames(event.get('inpoint') or 0, fps)
+        duration = durations.get(event['file_name'])
+        playable = None
+        if duration is not None:
+            # Whole frames of the asset left after the inpoint
+            playable = int(math.floor(Fraction(duration) * fps)) - inpoint_frames
+            if playable <= 0:
+                warnings.append(f"{label}: inpoint is past the end of the asset, dropped")
+                continue
+
+        if end_frame < start_frame:
+            warnings.append(f"{label}: ends before it starts, dropped")
+            continue
+        if end_frame == start_frame:
+            # Older schedules saved events without a slot length; they play the whole asset
+            if playable is None:
+                warnings.append(f"{label}: has no slot length and no known asset duration, dropped")
+                continue
+            end_frame = start_frame + playable
+        elif playable is not None and start_frame + playable < end_frame:
+            warnings.append(f"{label}: asset is {to_seconds(end_frame - start_frame - playable, fps):.3f}s "
+                            f"shorter than its slot, filler covers the rest")
+            end_frame = start_frame + playable
+        if end_frame > day_frames:
+            warnings.append(f"{label}: runs past midnight, cut at the end of the day")
+            end_frame = day_frames
+
+        candidates.append({
+            'position': position,
+            'file_name': event['file_name'],
+            'start_frame': start_frame,
+            'end_frame': end_frame,
+            'inpoint_frames': inpoint_frames,
+            'label': label,
+        })
+
+    resolved = []
+    for candidate in sorted(candidates, key=lambda c: (c['start_frame'], c['position'])):
+        if resolved and candidate['start_frame'] < resolved[-1]['end_frame']:
+            previous = resolved[-1]
+            if candidate['start_frame'] == previous['start_frame']:
+                warnings.append(f"{candidate['label']}: same start as {previous['label']}, dropped")
+                continue
+            warnings.append(f"{previous['label']}: overlaps {candidate['label']}, cut at its start")
+            previous['end_frame'] = candidate['start_frame']
+        resolved.append(candidate)
+
+    def clock(frames):
+        return (day_start + timedelta(seconds=to_seconds(frames, fps))).isoformat()
+
+    items = []
+    cursor = 0
+    for event in resolved + [None]:
+        gap_end = event['start_frame'] if event else day_frames
+        if cursor < gap_end:
+            items.append({'kind': 'filler', 'start_frame': cursor, 'end_frame': gap_end,
+                          'start': clock(cursor), 'end': clock(gap_end)})
+        if event is None:
+            break
+        items.append({
+            'kind': 'event',
+            'file_name': event['file_name'],
+            'start_frame': event['start_frame'],
+            'end_frame': event['end_frame'],
+            'start': clock(event['start_frame']),
+            'end': clock(event['end_frame']),
+            'inpoint': to_seconds(event['inpoint_frames'], fps),
+            'duration': to_seconds(event['end_frame'] - event['start_frame'], fps),
+        })
+        cursor = event['end_frame']
+
+    return {
+        'date': date,
+        'frame_rate': str(fps),
+        'compiled_at': datetime.now().isoformat(),
+        'items': items,
+        'warnings': warnings,
+    }
+
+
+def get_compiled_schedule(date):
+    """The compiled timeline for a date, recompiled only when its events or durations changed."""
+    schedule = schedule_db.getByQuery({"date": date})
+    events = schedule[0]['events'] if schedule else []
+    durations = _asset_durations(events)
+    current_hash = source_hash(events, durations)
+
+    compiled = compiled_schedule_db.get(date)
+    if compiled and compiled['source_hash'] == current_hash:
+        return compiled
+
+    compiled = compile_schedule(date, events, durations)
+    for warning in compiled['warnings']:
+        print(f"Schedule {date}: {warning}")
+    compiled_schedule_db.put(date, current_hash, compiled)
+    return dict(compiled, source_hash=current_hash)
@@ -1,6 +1,10 @@
 from apscheduler.schedulers.background import BackgroundScheduler
 from .tasks.daily_task import daily_task
-from .config import EVENT_FILE_DIR
+from .config import EVENT_FILE_DIR, PREFETCH_POLL_SECONDS, DRIFT_POLL_SECONDS
+from .prefetch_scheduler import prefetch_due_assets
+from .drift_monitor import check_drift
+from .segment_library import ensure_blank_in_library
+from .utils import prepare_fillers
 from datetime import datetime
 import os
 from flask import current_app
@@ -33,8 +37,17 @@ def initialize_scheduler(app):
             print(f"Previous day's event file deleted for date {todayFileDate}")
             os.remove(today_event_file)
 
+        # The stitcher loops the blank clip over gaps, so it must be in the segment library
+        ensure_blank_in_library()
+        # Render the fixed filler lengths up front, off the request path
+        prepare_fillers()
+
         # Add the daily task job
         scheduler.add_job(scheduled_daily_task, 'cron', hour=0, minute=0)  # Adjust the time as needed
+        # Download upcoming assets ahead of their start time
+        scheduler.add_job(prefetch_due_assets, 'interval', seconds=PREFETCH_POLL_SECONDS, next_run_time=datetime.now())
+        # Compare playout position with the timeline and absorb drift in filler gaps
+        scheduler.add_job(check_drift, 'interval', seconds=DRIFT_POLL_SECONDS)
         print("Job added")
         scheduler.start()
         print("Scheduler started")
@@ -0,0 +1,175 @@
+import os
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from .config import (s3_client, BUCKET_NAME, OUTPUT_VIDEO_DIR, ABR_LADDER, HLS_SEGMENT_SECONDS, LIBRARY_DIR_NAME,
+                     LIBRARY_S3_PREFIX, LIBRARY_ENCODER_PROFILE, LIBRARY_MAX_WORKERS, LIBRARY_UPLOAD)
+from .databases import metadata_db, library_db, probe_db
+from .media_probe import get_media_info, probe_asset
+from .asset_cache import cached_path, is_cached, transfer_config
+from .encoding import ENCODER_PROFILES, conformance_issues, encoder_args, rate_args
+from .utils import BLANK_VIDEO_PATH
+
+# Each asset is encoded once, outside the real-time path, into the channel's HLS ladder with
+# aligned GOPs. Segments live under OUTPUT_VIDEO_DIR/library/<etag>/<rendition>_seg_NNNNN.ts so the
+# playout side only has to reference them. Conformant assets keep their top rendition as a
+# stream copy and the lower renditions follow its keyframes.
+
+executor = ThreadPoolExecutor(max_workers=LIBRARY_MAX_WORKERS, thread_name_prefix='asset-library')
+
+
+def library_dir(etag):
+    return os.path.join(OUTPUT_VIDEO_DIR, LIBRARY_DIR_NAME, etag)
+
+
+def library_uri(etag, name):
+    """Segment/playlist path relative to OUTPUT_VIDEO_DIR, as served by /output_videos."""
+    return f"{LIBRARY_DIR_NAME}/{etag}/{name}"
+
+
+def library_command(source_path, output_dir, info, ladder=ABR_LADDER, profile_name=LIBRARY_ENCODER_PROFILE):
+    """ffmpeg command that segments one asset into every rendition of the ladder (VOD playlists)."""
+    copy_top = not conformance_issues(info)
+    profile = ENCODER_PROFILES[profile_name]
+    encoded = [i for i in range(len(ladder)) if not (copy_top and i == 0)]
+
+    command = ['ffmpeg', '-y', '-v', 'error', '-i', source_path]
+    if encoded:
+        splits = ''.join(f'[v{i}]' for i in encoded)
+        scales = '; '.join(f"[v{i}]scale=w={ladder[i]['width']}:h={ladder[i]['height']}[v{i}out]" for i in encoded)
+        command += ['-filter_complex', f"[0:v]split={len(encoded)}{splits}; {scales}"]
+
+    for i, rung in enumerate(ladder):
+        if i in encoded:
+            command += ['-map', f'[v{i}out]', f'-c:v:{i}', 'libx264']
+            command += rate_args(profile, rung['video_bitrate'], rung['maxrate'], rung['bufsize'], stream=i)
+        else:
+            command += ['-map', '0:v:0', f'-c:v:{i}', 'copy']
+    for i, rung in enumerate(ladder):
+        if i in encoded:
+            command += ['-map', '0:a:0', f'-c:a:{i}', 'aac', f'-b:a:{i}', rung['audio_bitrate'], f'-ac:a:{i}', '2']
+        else:
+            command += ['-map', '0:a:0', f'-c:a:{i}', 'copy']
+
+    if encoded:
+        output_pixels = sum(ladder[i]['width'] * ladder[i]['height'] for i in encoded)
+        command += encoder_args(profile_name, concurrent_streams=1, output_pixels=output_pixels, include_rates=False,
+                                force_key_frames='source' if copy_top else None)
+
+    command += [
+        '-var_stream_map', ' '.join(f"v:{i},a:{i},name:{rung['name']}" for i, rung in enumerate(ladder)),
+        '-f', 'hls', '-hls_time', str(HLS_SEGMENT_SECONDS), '-hls_playlist_type', 'vod',
+        '-hls_flags', 'independent_segments', '-hls_segment_type', 'mpegts',
+        '-hls_segment_filename', os.path.join(output_dir, '%v_seg_%05d.ts'),
+        '-master_pl_name', 'master.m3u8', os.path.join(output_dir, '%v.m3u8')
+    ]
+    return command, ('remux' if copy_top else 'transcode')
+
+
+def parse_media_playlist(path):
+    """[[segment file name, duration], ...] from an HLS media playlist."""
+    segments = []
+    duration = None
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('#EXTINF:'):
+                duration = float(line[len('#EXTINF:'):].split(',')[0])
+            elif line and not line.startswith('#') and duration is not None:
+                segments.append([line, duration])
+                duration = None
+    return segments
+
+
+def _upload_library(etag, output_dir):
+    def upload(name):
+        s3_client.upload_file(os.path.join(output_dir, name), BUCKET_NAME, f"{LIBRARY_S3_PREFIX}{etag}/{name}")
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        list(pool.map(upload, sorted(os.listdir(output_dir))))
+    print(f"Uploaded library entry {etag} to s3://{BUCKET_NAME}/{LIBRARY_S3_PREFIX}{etag}/")
+
+
+def _registered_etag(file_name):
+    record = metadata_db.getByQuery({"file_name": file_name})
+    return record[0].get('etag') if record else None
+
+
+def _source_path(file_name, scratch_dir):
+    """The asset's copy in the playout cache if it has one, otherwise a download into scratch_dir.
+
+    Library builds do not go through the playout cache: that would fill its LRU with every
+    ingested asset.
+    """
+    if is_cached(file_name):
+        return cached_path(file_name)
+    path = os.path.join(scratch_dir, os.path.basename(file_name))
+    s3_client.download_file(BUCKET_NAME, file_name, path, Config=transfer_config)
+    return path
+
+
+def build_library_entry(file_name, etag=None):
+    """Segment one asset into the library; returns the library record.
+
+    Registered assets are looked up by file name; others (the blank filler) pass the
+    ETag of their probed content.
+    """
+    etag = etag or _registered_etag(file_name)
+    if not etag:
+        raise Exception(f"{file_name} has no probe data yet")
+
+    try:
+        library_db.put(etag, file_name, 'processing')
+        probe = probe_db.get(etag)
+        info = get_media_info(file_name) or (probe['info'] if probe else None)
+        output_dir = library_dir(etag)
+        os.makedirs(output_dir, exist_ok=True)
+
+        with tempfile.TemporaryDirectory(prefix='library-') as scratch_dir:
+            command, mode = library_command(_source_path(file_name, scratch_dir), output_dir, info)
+            print(f"Building library entry for {file_name} ({mode})")
+            result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            raise Exception(f"ffmpeg error: {result.stderr.decode('utf-8')}")
+
+        renditions = {}
+        for rung in ABR_LADDER:
+            segments = parse_media_playlist(os.path.join(output_dir, f"{rung['name']}.m3u8"))
+            renditions[rung['name']] = [[library_uri(etag, name), duration] for name, duration in segments]
+        duration = sum(duration for _, duration in renditions[ABR_LADDER[0]['name']])
+
+        if LIBRARY_UPLOAD:
+            _upload_library(etag, output_dir)
+        library_db.put(etag, file_name, 'ready', mode=mode, duration=duration, renditions=renditions)
+        print(f"Library entry for {file_name} ready: {len(renditions[ABR_LADDER[0]['name']])} segments, {duration:.2f}s")
+        return library_db.get(etag)
+    except Exception as e:
+        print(f"Error building library entry for {file_name}: {e}")
+        library_db.put(etag, file_name, 'failed', error=str(e))
+        raise
+
+
+def queue_library_build(file_name, etag=None):
+    """Queue an asset for segmenting unless its content is already in (or on its way to) the library."""
+    etag = etag or _registered_etag(file_name)
+    if not etag:
+        print(f"Not queueing {file_name} for the library: no probe data")
+        return None
+
+    existing = library_db.get(etag)
+    if existing and existing['status'] in ('pending', 'processing', 'ready'):
+        return existing['status']
+
+    library_db.put(etag, file_name, 'pending')
+    executor.submit(build_library_entry, file_name, etag)
+    return 'pending'
+
+
+def ensure_blank_in_library():
+    """Queue the blank filler clip for the library; the stitcher loops it over every gap."""
+    try:
+        etag, _ = probe_asset(BUCKET_NAME, BLANK_VIDEO_PATH)
+        return queue_library_build(BLANK_VIDEO_PATH, etag)
+    except Exception as e:
+        print(f"Error adding the blank filler to the library: {e}")
+        return None
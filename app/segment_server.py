@@ -0,0 +1,152 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from flask import request, send_from_directory, Response, abort
+from werkzeug.security import safe_join
+from .config import (SEGMENT_MEMORY_CACHE_BYTES, SEGMENT_MEMORY_CACHE_MAX_ITEM_BYTES, SEGMENT_MEMORY_CACHE_TTL_SECONDS,
+                     SEGMENT_MAX_AGE_SECONDS, PLAYLIST_MAX_AGE_SECONDS, BLOCKING_RELOAD_TIMEOUT_FACTOR,
+                     LOW_LATENCY_PART_SECONDS)
+from .blocking_reload import playlist_watcher, parse_blocking_request, add_server_control, BlockingReloadError
+from .low_latency import (PART_PATTERN, is_part_playlist, render_low_latency_playlist, segment_part_paths,
+                          read_segment)
+
+# Serving for /output_videos. Segments never change once written (their names carry the
+# encoder run, see encoding.media_prefix, and library segments the ETag of their asset), so
+# they get a long-lived Cache-Control and an ETag, and the recently requested ones are
+# answered from memory without touching the filesystem. Playlists change every segment and
+# get a short max-age; they also
+# support LL-HLS blocking reloads (see blocking_reload) and low-latency part playlists are
+# rendered with EXT-X-PART (see low_latency).
+
+SEGMENT_TYPES = {
+    '.ts': 'video/MP2T',
+    '.m4s': 'video/iso.segment',
+    '.mp4': 'video/mp4',
+}
+PLAYLIST_TYPE = 'application/vnd.apple.mpegurl'
+
+
+class SegmentMemoryCache:
+    """LRU of segment bytes bounded by total size, with a TTL per entry."""
+
+    def __init__(self, max_bytes, ttl_seconds):
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.entries = OrderedDict()  # path -> (data, etag, loaded_at)
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is None:
+                return None
+            if time.time() - entry[2] > self.ttl_seconds:
+                self._remove(path)
+                return None
+            self.entries.move_to_end(path)
+            return entry
+
+    def put(self, path, data, etag):
+        with self.lock:
+            if path in self.entries:
+                self._remove(path)
+            self.entries[path] = (data, etag, time.time())
+            self.size += len(data)
+            while self.size > self.max_bytes and self.entries:
+                self._remove(next(iter(self.entries)))
+
+    def _remove(self, path):
+        data, _, _ = self.entries.pop(path)
+        self.size -= len(data)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+
+segment_cache = SegmentMemoryCache(SEGMENT_MEMORY_CACHE_BYTES, SEGMENT_MEMORY_CACHE_TTL_SECONDS)
+
+
+def _load_segment(directory, filename, path):
+    """Read a segment into the memory cache; returns None if it is too large to keep."""
+    part_paths = segment_part_paths(directory, filename)
+    if part_paths is not None:
+        # A low-latency segment only exists as the parts it is made of
+        data = read_segment(part_paths)
+        etag = f"{len(data):x}-{os.stat(part_paths[-1]).st_mtime_ns:x}"
+        segment_cache.put(path, data, etag)
+        return data, etag, time.time()
+
+    if PART_PATTERN.match(filename) and not os.path.exists(path):
+        # A preload-hinted part: hold the request until ffmpeg has written it
+        playlist_watcher.wait_for_file(path, BLOCKING_RELOAD_TIMEOUT_FACTOR * LOW_LATENCY_PART_SECONDS)
+    stat = os.stat(path)
+    if stat.st_size > SEGMENT_MEMORY_CACHE_MAX_ITEM_BYTES:
+        return None
+    with open(path, 'rb') as f:
+        data = f.read()
+    etag = f"{stat.st_size:x}-{stat.st_mtime_ns:x}"
+    segment_cache.put(path, data, etag)
+    return data, etag, time.time()
+
+
+def serve_output_file(directory, filename):
+    """Serve a file from the HLS output directory with caching headers and range support."""
+    path = safe_join(directory, filename)
+    if path is None:
+        abort(404)
+    extension = os.path.splitext(filename)[1]
+
+    if extension in SEGMENT_TYPES:
+        entry = segment_cache.get(path)
+        if entry is None:
+            try:
+                entry = _load_segment(directory, filename, path)
+            except FileNotFoundError:
+                abort(404)
+        if entry is not None:
+            data, etag, _ = entry
+            response = Response(data, mimetype=SEGMENT_TYPES[extension])
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = f'public, max-age={SEGMENT_MAX_AGE_SECONDS}, immutable'
+            # Handles If-None-Match and Range against the in-memory body
+            return response.make_conditional(request, accept_ranges=True, complete_length=len(data))
+
+        response = send_from_directory(directory, filename, conditional=True, etag=True,
+                                       max_age=SEGMENT_MAX_AGE_SECONDS, mimetype=SEGMENT_TYPES[extension])
+        response.headers['Cache-Control'] = f'public, max-age={SEGMENT_MAX_AGE_SECONDS}, immutable'
+        return response
+
+    if extension == '.m3u8':
+        return serve_playlist(path)
+    return send_from_directory(directory, filename, conditional=True, etag=True)
+
+
+def render_playlist(text, path=None):
+    """The playlist as clients see it: parts grouped into LL-HLS segments, or ffmpeg's own."""
+    if is_part_playlist(text):
+        return render_low_latency_playlist(text, key=path)
+    return add_server_control(text)
+
+
+def serve_playlist(path):
+    """Serve a playlist, holding LL-HLS blocking reload requests until the sequence exists."""
+    try:
+        blocking = parse_blocking_request(request.args)
+        if blocking is not None:
+            text = playlist_watcher.wait_for(path, *blocking, render=lambda text: render_playlist(text, path))
+        else:
+            with open(path, 'r') as f:
+                text = render_playlist(f.read(), path)
+    except BlockingReloadError as e:
+        return {"error": str(e)}, e.status
+
+    body = text.encode()
+    response = Response(body, mimetype=PLAYLIST_TYPE)
+    response.set_etag(hashlib.md5(body).hexdigest())
+    response.headers['Cache-Control'] = f'public, max-age={PLAYLIST_MAX_AGE_SECONDS}'
+    return response.make_conditional(request)
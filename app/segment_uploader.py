@@ -0,0 +1,115 @@
+import os
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, wait
+import boto3
+from botocore.config import Config
+from .config import AWS_REGION, SEGMENT_UPLOAD_WORKERS
+
+# Uploads HLS output on a bounded pool over one connection-pooled client. Each segment is
+# uploaded once, after ffmpeg closed it, and a playlist is only uploaded after every segment
+# it references has landed, so CDN viewers never see a listed segment that 404s.
+
+CONTENT_TYPES = {
+    '.ts': 'video/MP2T',
+    '.m4s': 'video/iso.segment',
+    '.mp4': 'video/mp4',
+    '.m3u8': 'application/vnd.apple.mpegurl',
+}
+
+
+class SegmentUploader:
+    def __init__(self, bucket_name, prefix, max_workers=SEGMENT_UPLOAD_WORKERS):
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.client = boto3.client(
+            's3', region_name=AWS_REGION,
+            config=Config(max_pool_connections=max_workers * 2, retries={'max_attempts': 5, 'mode': 'adaptive'})
+        )
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='segment-upload')
+        # Playlists wait on segment futures, so they get their own pool to avoid starving it
+        self.playlist_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='playlist-upload')
+        self.lock = threading.Lock()
+        self.segments = {}  # segment name -> (signature, future)
+        self.pending_playlists = set()
+
+    def _upload(self, path):
+        key = self.prefix + Path(path).name
+        content_type = CONTENT_TYPES.get(Path(path).suffix)
+        extra_args = {'ContentType': content_type} if content_type else None
+        self.client.upload_file(path, self.bucket_name, key, ExtraArgs=extra_args)
+        print(f"Uploaded {path} to s3://{self.bucket_name}/{key}")
+
+    def submit_segment(self, path):
+        """Queue a finished segment; repeated events for an unchanged file are ignored."""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        name = Path(path).name
+        signature = (stat.st_size, stat.st_mtime_ns)
+
+        with self.lock:
+            existing = self.segments.get(name)
+            if existing and existing[0] == signature:
+                return existing[1]
+            future = self.executor.submit(self._upload_segment, path)
+            self.segments[name] = (signature, future)
+        return future
+
+    def _upload_segment(self, path):
+        try:
+            self._upload(path)
+        except Exception as e:
+            print(f"Error uploading segment {path}: {e}")
+            with self.lock:
+                self.segments.pop(Path(path).name, None)
+            raise
+
+    def submit_playlist(self, path):
+        """Queue a playlist upload that waits for the segments it references.
+
+        Only one upload per playlist is queued at a time; it reads the file when it runs,
+        so bursts of rewrites collapse into a single upload of the latest version.
+        """
+        with self.lock:
+            if path in self.pending_playlists:
+                return
+            self.pending_playlists.add(path)
+        self.playlist_executor.submit(self._upload_playlist, path)
+
+    def _upload_playlist(self, path):
+        try:
+            with self.lock:
+                self.pending_playlists.discard(path)
+            with open(path, 'r') as f:
+                lines = [line.strip() for line in f]
+
+            directory = os.path.dirname(path)
+            futures = []
+            for line in lines:
+                if not line or line.startswith('#'):
+                    continue
+                if line.endswith('.m3u8'):
+                    continue  # Variant playlists in a master playlist are uploaded on their own
+                future = self.submit_segment(os.path.join(directory, line))
+                if future is not None:
+                    futures.append(future)
+
+            wait(futures)
+            failed = [future for future in futures if future.exception()]
+            if failed:
+                print(f"Skipping upload of {path}: {len(failed)} referenced segment(s) failed to upload")
+                return
+            self._upload(path)
+        except Exception as e:
+            print(f"Error uploading playlist {path}: {e}")
+
+    def forget(self, name):
+        with self.lock:
+            self.segments.pop(name, None)
+
+    def reset(self):
+        with self.lock:
+            self.segments.clear()
+            self.pending_playlists.clear()
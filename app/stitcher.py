@@ -0,0 +1,178 @@
+import math
+import time
+import threading
+from bisect import bisect_right
+from datetime import datetime
+from .config import ABR_LADDER, STITCHER_WINDOW_SEGMENTS, STITCHER_CACHE_SECONDS, STITCHED_PLAYLIST_PREFIX
+from .databases import library_db, stitch_sequence_db
+from .segment_library import ensure_blank_in_library
+from .utils import LOCAL_TIMEZONE, BLANK_VIDEO_PATH, build_event_timeline
+
+# Live HLS without a running encoder: the day's timeline is compiled once into a flat list of
+# library segments with their start offsets, and each playlist request only bisects the current
+# wall-clock offset into it and prints the sliding window around it.
+#
+# Media and discontinuity sequence numbers must keep increasing across midnight, so each day's
+# first segment continues from the last day served (stored per rendition in stitch_sequences)
+# and opens with a discontinuity.
+
+
+class StitchError(Exception):
+    pass
+
+
+_compiled = {}
+_lock = threading.Lock()
+
+
+def _library_segments(file_name, rendition):
+    entry = library_db.get_by_file_name(file_name)
+    if not entry or entry['status'] != 'ready' or rendition not in entry['renditions']:
+        return None
+    return entry['renditions'][rendition]
+
+
+def compile_day(date, rendition):
+    """Flatten the day's timeline into segments for one rendition.
+
+    Every asset (and every blank repetition) starts with a discontinuity, and so does the
+    first segment of the day, where timestamps start over. Fillers repeat
+    the blank clip's segments until the next scheduled start is within half a segment, so
+    scheduled starts never drift by more than that.
+    """
+    blank = _library_segments(BLANK_VIDEO_PATH, rendition)
+    if not blank:
+        status = ensure_blank_in_library()
+        raise StitchError(f"Blank filler {BLANK_VIDEO_PATH} is not in the asset library yet ({status or 'failed'})")
+
+    day_start = LOCAL_TIMEZONE.localize(datetime.fromisoformat(date))
+    starts, durations, uris, discontinuities = [], [], [], []
+    position = 0.0
+
+    def append(segments, until):
+        nonlocal position
+        first = True
+        for uri, duration in segments:
+            if position + duration / 2 > until:
+                break
+            starts.append(position)
+            durations.append(duration)
+            uris.append(uri)
+            discontinuities.append(first)
+            position += duration
+            first = False
+
+    for item in build_event_timeline(date, day_start):
+        until = (item['end'] - day_start).total_seconds()
+        segments = _library_segments(item['file_name'], rendition) if item['kind'] == 'event' else None
+        if item['kind'] == 'event' and segments is None:
+            print(f"{item['file_name']} is not in the asset library yet, stitching blank filler instead")
+        if segments:
+            append(segments, until)
+            continue
+        # Loop the blank clip over the gap
+        while position + blank[0][1] / 2 <= until:
+            before = position
+            append(blank, until)
+            if position == before:
+                break
+
+    discontinuity_prefix = [0]
+    for flag in discontinuities:
+        discontinuity_prefix.append(discontinuity_prefix[-1] + int(flag))
+
+    origin = stitch_sequence_db.get(rendition, date)
+    if origin is None:
+        previous = stitch_sequence_db.latest_before(rendition, date)
+        origin = {
+            'media_sequence': previous['media_sequence'] + previous['segments'] if previous else 0,
+            'discontinuity_sequence': previous['discontinuity_sequence'] + previous['discontinuities'] if previous else 0,
+        }
+    stitch_sequence_db.put(rendition, date, origin['media_sequence'], len(starts),
+                           origin['discontinuity_sequence'], discontinuity_prefix[-1])
+
+    return {
+        'media_sequence': origin['media_sequence'],
+        'discontinuity_sequence': origin['discontinuity_sequence'],
+        'starts': starts,
+        'durations': durations,
+        'uris': uris,
+        'discontinuities': discontinuities,
+        'discontinuity_prefix': discontinuity_prefix,
+        'target_duration': math.ceil(max(durations)) if durations else 6,
+        'compiled_at': time.time(),
+    }
+
+
+def get_compiled(date, rendition):
+    key = (date, rendition)
+    with _lock:
+        compiled = _compiled.get(key)
+    if compiled and time.time() - compiled['compiled_at'] < STITCHER_CACHE_SECONDS:
+        return compiled
+
+    compiled = compile_day(date, rendition)
+    with _lock:
+        _compiled[key] = compiled
+    return compiled
+
+
+def invalidate(date=None):
+    """Drop compiled timelines (of one date, or all) after a schedule or library change."""
+    with _lock:
+        for key in list(_compiled):
+            if date is None or key[0] == date:
+                del _compiled[key]
+
+
+def media_playlist(rendition, now=None):
+    """Sliding live media playlist for the current wall-clock time."""
+    now = now or datetime.now(LOCAL_TIMEZONE)
+    date = now.date().isoformat()
+    compiled = get_compiled(date, rendition)
+    if not compiled['starts']:
+        raise StitchError(f"Nothing to stitch for {date}")
+
+    offset = (now - LOCAL_TIMEZONE.localize(datetime.fromisoformat(date))).total_seconds()
+    current = min(max(bisect_right(compiled['starts'], offset) - 1, 0), len(compiled['starts']) - 1)
+    first = max(current - STITCHER_WINDOW_SEGMENTS + 1, 0)
+
+    lines = [
+        '#EXTM3U',
+        '#EXT-X-VERSION:3',
+        f"#EXT-X-TARGETDURATION:{compiled['target_duration']}",
+        f"#EXT-X-MEDIA-SEQUENCE:{compiled['media_sequence'] + first}",
+        f"#EXT-X-DISCONTINUITY-SEQUENCE:{compiled['discontinuity_sequence'] + compiled['discontinuity_prefix'][first]}",
+    ]
+    for index in range(first, current + 1):
+        if compiled['discontinuities'][index]:
+            lines.append('#EXT-X-DISCONTINUITY')
+        lines.append(f"#EXTINF:{compiled['durations'][index]:.3f},")
+        lines.append(compiled['uris'][index])
+    return '\n'.join(lines) + '\n'
+
+
+def master_playlist():
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3']
+    for rung in ABR_LADDER:
+        bandwidth = _bits(rung['maxrate']) + _bits(rung['audio_bitrate'])
+        lines.append(f"#EXT-X-STREAM-INF:BANDWIDTH={bandwidth},RESOLUTION={rung['width']}x{rung['height']}")
+        lines.append(f"{STITCHED_PLAYLIST_PREFIX}{rung['name']}.m3u8")
+    return '\n'.join(lines) + '\n'
+
+
+def _bits(rate):
+    units = {'k': 1000, 'K': 1000, 'm': 1000000, 'M': 1000000}
+    return int(float(rate[:-1]) * units[rate[-1]]) if rate[-1] in units else int(rate)
+
+
+def stitched_playlist(filename):
+    """Playlist text for a stitched_* file name under /output_videos, or None if it is not one."""
+    if not filename.startswith(STITCHED_PLAYLIST_PREFIX) or not filename.endswith('.m3u8'):
+        return None
+    name = filename[len(STITCHED_PLAYLIST_PREFIX):-len('.m3u8')]
+    if name == 'master':
+        return master_playlist()
+    if name not in {rung['name'] for rung in ABR_LADDER}:
+        return None
+    return media_playlist(name)
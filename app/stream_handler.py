@@ -1,15 +1,20 @@
 import os
 import time
-import subprocess
 import threading
 from pathlib import Path
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import boto3
 from .hls_service import start_fetcher
-import psutil
-import signal
+from .segment_uploader import SegmentUploader
+from .s3_cleanup import cleanup_prefix
+from .encoding import hls_playout_command, uses_stream_copy
+from .config import HLS_LATENCY_MODE, HLS_JOB_ID, PLAYOUT_MODE
+from .process_manager import supervisor
+from .alerts import send_alert
+from .rolling_playlist import reroot_event_file, set_stream_copy
+from .utils import LOCAL_TIMEZONE
 
 
 # S3 setup
@@ -21,68 +26,42 @@ HLS_FOLDER = 'hls/'
 TEMP_DIR = 'output_videos'
 EVENT_FILE_DIR = 'event_files'
 
+# Created by start_file_monitoring; S3 mirroring of the HLS output is not wired into
+# start_stream (players are served from /output_videos), so nothing is built at import time
+segment_uploader = None
+
 # Globals for process and thread management
-ffmpeg_process = None
 monitoring_thread = None
 stop_event = threading.Event()
 
 
 # File Monitoring Class
 class FileUploadHandler(FileSystemEventHandler):
-    
-    def on_created(self, event):
-        print(f'event type: {event.event_type}  path : {event.src_path}')
-        if event.src_path.endswith('.ts'):
-            # Upload .ts segments
-            self.upload_file(event.src_path, '.ts')
-        
-        elif event.src_path.endswith('.m3u8'):
-            # Ensure playlist is uploaded, even if it's not fully written
-            if event.src_path.endswith('.tmp'):
-                print(f"Skipping .tmp file: {event.src_path}")
-                return
-            self.upload_file(event.src_path, '.m3u8')
-        
-   
-    def on_moved(self, event):
-        print(f'event type: {event.event_type}  path : {event.src_path}')
-        if event.src_path.endswith('.tmp'):
-            self.upload_file(event.src_path.split('.tmp')[0], '.m3u8')
+    """Hands finished HLS files to the pooled segment uploader instead of uploading inline."""
 
     def on_closed(self, event):
-        print(f'event type: {event.event_type}  path : {event.src_path}')
-        """Upload new .ts files and .m3u8 playlist to S3 as they are created."""
-        print(f"New file created: {event.src_path}")
-        if event.src_path.endswith('.ts'):
-            # Upload .ts segments
-            self.upload_file(event.src_path, '.ts')
-        
+        # Only a closed file is complete; on_created fires while ffmpeg is still writing
+        if event.src_path.endswith(('.ts', '.m4s', '.mp4')):
+            segment_uploader.submit_segment(event.src_path)
         elif event.src_path.endswith('.m3u8'):
-            # Ensure playlist is uploaded, even if it's not fully written
-            if event.src_path.endswith('.tmp'):
-                print(f"Skipping .tmp file: {event.src_path}")
-                return
-            self.upload_file(event.src_path, '.m3u8')
-            
-    def upload_file(self, src_path, file_type):
-        """Uploads a file to S3."""
-        try:
-            # Generate S3 key for the file
-            s3_key = HLS_FOLDER + Path(src_path).name
-            s3_client.upload_file(src_path, BUCKET_NAME, s3_key)
-            print(f"Uploaded {file_type} file: {src_path} to s3://{BUCKET_NAME}/{s3_key}")
-        except Exception as e:
-            print(f"Error uploading {file_type} to S3: {e}")
+            segment_uploader.submit_playlist(event.src_path)
+
+    def on_moved(self, event):
+        # ffmpeg writes playlists (and, in low-latency mode, parts) to <name>.tmp and renames them into place
+        if event.dest_path.endswith(('.ts', '.m4s', '.mp4')):
+            segment_uploader.submit_segment(event.dest_path)
+        elif event.dest_path.endswith('.m3u8'):
+            segment_uploader.submit_playlist(event.dest_path)
+
+    def on_deleted(self, event):
+        segment_uploader.forget(Path(event.src_path).name)
+
+
 # Utility Functions
 def clear_s3_folder():
     try:
-        response = s3_client.list_objects_v2(Bucket=BUCKET_NAME, Prefix=HLS_FOLDER)
-        if 'Contents' in response:
-            objects_to_delete = [{'Key': obj['Key']} for obj in response['Contents']]
-            s3_client.delete_objects(Bucket=BUCKET_NAME, Delete={'Objects': objects_to_delete})
-            print(f"Cleared S3 folder {HLS_FOLDER}.")
-        else:
-            print(f"S3 folder {HLS_FOLDER} is already empty.")
+        result = cleanup_prefix(BUCKET_NAME, HLS_FOLDER, client=s3_client)
+        print(f"Cleared S3 folder {HLS_FOLDER} ({result['deleted']} objects).")
     except Exception as e:
         print(f"Error clearing S3 folder {HLS_FOLDER}: {e}")
 
@@ -116,20 +95,16 @@ def delete_last_30_seconds_files():
 
     # Delete files from S3
     try:
-        response = s3_client.list_objects_v2(Bucket=BUCKET_NAME, Prefix=HLS_FOLDER)
-        if 'Contents' in response:
-            for obj in response['Contents']:
-                s3_key = obj['Key']
-                file_creation_time = obj['LastModified']
-                if file_creation_time > cutoff_time:
-                    s3_client.delete_object(Bucket=BUCKET_NAME, Key=s3_key)
-                    print(f"Deleted S3 file: s3://{BUCKET_NAME}/{s3_key}")
+        cleanup_prefix(BUCKET_NAME, HLS_FOLDER, newer_than=cutoff_time.astimezone(timezone.utc), client=s3_client)
     except Exception as e:
         print(f"Error deleting S3 files: {e}")
 
 
 def start_file_monitoring():
-    global stop_event
+    global stop_event, segment_uploader
+
+    if segment_uploader is None:
+        segment_uploader = SegmentUploader(BUCKET_NAME, HLS_FOLDER)
 
     def monitor():
         observer = Observer()
@@ -150,75 +125,46 @@ def start_file_monitoring():
 
 
 # FFmpeg Process Functions
-def run_ffmpeg(event_file, date):
-    global ffmpeg_process
-
-    ffmpeg_command = [
-        'ffmpeg', '-protocol_whitelist', 'file,crypto,data,https,tls,tcp', '-re', '-f', 'concat', '-safe', '0', '-i', event_file,
-        '-filter_complex', '[0:v]split=1[v1]; [v1]scale=w=854:h=480[v1out]',
-        '-map', '[v1out]', '-c:v:0', 'libx264', '-b:v:0', '5000k', '-maxrate:v:0', '5350k',
-        '-bufsize:v:0', '3500k', '-map', 'a:0', '-c:a', 'aac', '-b:a:0', '192k', '-ac', '2',
-        '-f', 'hls', '-hls_time', '6', 
-        '-hls_list_size','20',
-     '-hls_flags' ,'delete_segments',
-  '-hls_delete_threshold', '20',
-        '-hls_segment_type', 'mpegts', '-hls_segment_filename', os.path.join(TEMP_DIR, f'{date}_segment_%03d.ts'),
-        '-master_pl_name', 'master.m3u8', '-var_stream_map', 'v:0,a:0', os.path.join(TEMP_DIR, f'{date}_playlist.m3u8')
-    ]
+def _resume_command(job):
+    # At midnight the encoder re-roots on the day prepared ahead of time; a crashed encoder
+    # resumes at the current position of today's timeline instead of replaying its root
+    # event file from where it first started
+    date = datetime.now(LOCAL_TIMEZONE).date().isoformat()
+    if reroot_event_file(date) is None:
+        send_alert(f"No event file to restart the HLS encoder on for {date}, replaying its last one")
+        return None
+    job.metadata['date'] = date
+    set_stream_copy(date, uses_stream_copy(date, job.metadata['latency_mode'], PLAYOUT_MODE))
+    return hls_playout_command(f'{EVENT_FILE_DIR}/{date}.txt', date, TEMP_DIR, job.metadata['latency_mode'],
+                               PLAYOUT_MODE)
+
+
+def run_ffmpeg(event_file, date, latency_mode=HLS_LATENCY_MODE):
+    # Stream copy when the whole day conforms, otherwise one decode fanned out to the ABR ladder;
+    # low-latency mode writes short fMP4 parts instead
+    ffmpeg_command = hls_playout_command(event_file, date, TEMP_DIR, latency_mode, PLAYOUT_MODE)
+    # Schedule edits check this before patching in assets that cannot be stream-copied
+    set_stream_copy(date, uses_stream_copy(date, latency_mode, PLAYOUT_MODE))
 
     try:
         print(f"Starting FFmpeg for {date}...")
-        ffmpeg_process = subprocess.Popen(ffmpeg_command)
-        #ffmpeg_process.wait()
-        print(f"FFmpeg process completed for {date}.")
+        # A clean exit is the end of the day's event file: the end of the stream in daily
+        # playout, a re-root on the next day in continuous playout. Crashes are restarted with backoff
+        restart = 'always' if PLAYOUT_MODE == 'continuous' else 'on-failure'
+        supervisor.start(HLS_JOB_ID, ffmpeg_command, kind='hls', restart=restart,
+                         metadata={'date': date, 'latency_mode': latency_mode}, on_restart=_resume_command)
     except Exception as e:
         print(f"Error in FFmpeg process: {e}")
 
 
 def stop_ffmpeg():
-    global ffmpeg_process
-
-    if ffmpeg_process:
-        # Attempt to stop the global ffmpeg_process
-        try:
-            if ffmpeg_process.poll() is None:  # Check if the process is running
-                print("Stopping global FFmpeg process...")
-                ffmpeg_process.terminate()
-                ffmpeg_process.wait(timeout=5)
-                print("Global FFmpeg process stopped successfully.")
-                ffmpeg_process = None
-                return
-            else:
-                print("Global FFmpeg process already stopped.")
-        except subprocess.TimeoutExpired:
-            print("Global FFmpeg process did not terminate in time. Forcibly killing it...")
-            os.kill(ffmpeg_process.pid, signal.SIGKILL)
-            ffmpeg_process = None
-        except Exception as e:
-            print(f"Error stopping global FFmpeg process: {e}")
-            ffmpeg_process = None
-
-    # If no global process is found or stopped, locate and stop system-wide FFmpeg processes
-    print("No global FFmpeg process found or already stopped. Searching system-wide...")
-    try:
-        for process in psutil.process_iter(attrs=['pid', 'name', 'cmdline']):
-            if "ffmpeg" in process.info['name'] or \
-               any("ffmpeg" in arg for arg in (process.info['cmdline'] or [])):
-                print(f"Found FFmpeg process (PID: {process.info['pid']}), terminating...")
-                os.kill(process.info['pid'], signal.SIGTERM)
-                psutil.Process(process.info['pid']).wait(timeout=5)
-                print(f"FFmpeg process (PID: {process.info['pid']}) terminated successfully.")
-    except psutil.NoSuchProcess:
-        print("FFmpeg process already terminated.")
-    except psutil.TimeoutExpired:
-        print("FFmpeg process did not terminate in time. Forcibly killing it...")
-        os.kill(process.info['pid'], signal.SIGKILL)
-    except Exception as e:
-        print(f"Error stopping FFmpeg process: {e}")
+    # Only this channel's encoder is stopped; other ffmpeg jobs on the host keep running
+    if not supervisor.stop(HLS_JOB_ID):
+        print("No FFmpeg process running for the HLS channel.")
 
 
 # Main Streaming Control Functions
-def start_stream(date):
+def start_stream(date, latency_mode=HLS_LATENCY_MODE):
     global monitoring_thread, stop_event
 
     os.makedirs(TEMP_DIR, exist_ok=True)
@@ -230,8 +176,13 @@ def start_stream(date):
     stop_ffmpeg()
     stop_event.set()
     
-    clear_s3_folder()
-    clear_output_folder()
+    if PLAYOUT_MODE == 'daily':
+        clear_s3_folder()
+        clear_output_folder()
+        if segment_uploader is not None:
+            segment_uploader.reset()
+    # In continuous playout the encoder appends to the live playlists already on disk and in
+    # S3, so players keep their position and the media sequence carries on
     # if monitoring_thread and monitoring_thread.is_alive():
     #     monitoring_thread.join()
 
@@ -239,7 +190,7 @@ def start_stream(date):
     stop_event.clear()
     #start_fetcher()
    # monitoring_thread = start_file_monitoring()
-    threading.Thread(target=run_ffmpeg, args=(event_file, date)).start()
+    run_ffmpeg(event_file, date, latency_mode)
 
 
 def stop_stream():
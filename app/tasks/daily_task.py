@@ -1,6 +1,7 @@
 from datetime import datetime, timedelta
-from ..utils import generate_event_file
-import os
+from ..rolling_playlist import write_rolling_event_file, remove_rolling_event_files, prepare_next_day
+from ..config import PLAYOUT_MODE
+from ..alerts import send_alert
 from app.ffmpeg_service import start_ffmpeg_service
 import pytz
 
@@ -10,14 +11,23 @@ india_tz = pytz.timezone('Asia/Kolkata')
 def daily_task():
     date = datetime.now(india_tz).date().isoformat()
 
+    if PLAYOUT_MODE == 'continuous':
+        # The encoder has already moved on into today's chunks; keep yesterday's files for the
+        # last chunk that may still be open, and write tomorrow so today's last chunk can link to it
+        stale_date = (datetime.now(india_tz) - timedelta(days=2)).date().isoformat()
+        remove_rolling_event_files(stale_date)
+        if prepare_next_day(date) is None:
+            # The encoder would be re-rooted on a day rebuilt at midnight, or not at all
+            send_alert(f"Playout for the day after {date} could not be prepared, check the schedule and event files")
+        print(f"Daily task completed for date {date}")
+        return
+
     # Delete previous day file
     previous_date = (datetime.now() - timedelta(days=1)).date().isoformat()
-    previous_event_file = os.path.join(EVENT_FILE_DIR, f"{previous_date}.txt")
-    if os.path.exists(previous_event_file):
-        os.remove(previous_event_file)
+    remove_rolling_event_files(previous_date)
 
     # Generate new event file and start stream
-    generate_event_file(date)
+    write_rolling_event_file(date)
     start_ffmpeg_service(date)
     
     print(f"Daily task completed for date {date}")
@@ -1,14 +1,16 @@
 import os
 import logging
-from datetime import datetime
-from .databases import schedule_db
+from datetime import datetime, timedelta
 import boto3
 import ffmpeg
-from .config import s3_client, BUCKET_NAME, EVENT_FILE_DIR, OUTPUT_VIDEO_DIR,OUTPUT_VIDEO_DIR_FFMPEG,upload_video_folder
+from .config import BUCKET_NAME, EVENT_FILE_DIR, OUTPUT_VIDEO_DIR,OUTPUT_VIDEO_DIR_FFMPEG,upload_video_folder
+from .config import FILLER_MODE, FILLER_DIR, FILLER_LENGTHS, BLANK_VIDEO_DURATION
 import subprocess
-from .databases import metadata_db
+from .media_probe import probe_asset
+from .presigned_urls import get_presigned_url
+from .asset_cache import resolve_asset, pin_assets
+from .schedule_compiler import get_compiled_schedule
 import pytz
-import json
 from botocore.exceptions import NoCredentialsError, PartialCredentialsError
 
 LOCAL_TIMEZONE = pytz.timezone('Asia/Kolkata')  # Replace with your desired timezone
@@ -19,90 +21,180 @@ logger = logging.getLogger(__name__)
 BLANK_VIDEO_PATH= f"{upload_video_folder}/blank_video.mp4"
 
 def generate_presigned_url_func(file_name):
-    return s3_client.generate_presigned_url(
-        'put_object',
-        Params={'Bucket': BUCKET_NAME, 'Key': file_name},
-        ExpiresIn=3600
-    )
+    return get_presigned_url('put_object', BUCKET_NAME, file_name)
 # Assuming you want to work with your local server time or a specific timezone
 
 
-def generate_event_file(date):
-    try:
-        # Fetch schedule for the given date
-        schedule = schedule_db.getByQuery({"date": date})
-        events = schedule[0]['events'] if schedule else []
-
-        lines = []
-        line_number = 1  # Initialize line number
-
-        # Get the current time in the specified timezone and format
-        now = datetime.now(LOCAL_TIMEZONE)
-        current_time_24hr = now.strftime('%Y-%m-%d %H:%M:%S')
-        current_time = datetime.strptime(current_time_24hr, '%Y-%m-%d %H:%M:%S')
-        current_time = LOCAL_TIMEZONE.localize(current_time)
-        print(f"Current Time: {current_time}")
-
-        for event in sorted(events, key=lambda e: e['start_time']):
-            start_time = datetime.fromisoformat(event['start_time'])
-            end_time = datetime.fromisoformat(event['end_time'])
-
-            # Localize event times to the same timezone
-            start_time = LOCAL_TIMEZONE.localize(start_time)
-            end_time = LOCAL_TIMEZONE.localize(end_time)
-
-            # Skip event if it's already in the past
-            if start_time < current_time:
-                print(f"Skipping event {event['file_name']} as it is in the past ({start_time})")
-                continue  # Skip the event if its start time is in the past
-
-            # Fill gap with blank videos if current time is before the event's start time
-            if current_time < start_time:
-                gap_duration = (start_time - current_time).total_seconds()
-                full_blanks = int(gap_duration // 10)  # Number of 1-second blanks
-
-                # Append full blank video repetitions
-                for _ in range(full_blanks):
-                    lines.append(f"file '{BLANK_VIDEO_PATH}'")
-                  #  lines.append("duration 1")
-                    line_number += 2  # Each blank video adds 2 lines (file + duration)
-
-            # Append the event video
-            #file_path = f"https://{BUCKET_NAME}.s3.ap-south-1.amazonaws.com/{event['file_name']}"
-            file_path = f"{event['file_name']}"
-            lines.append(f"file '{file_path}'")
-#            duration = (end_time - start_time).total_seconds()
- #           lines.append(f"duration {duration}")
+def filler_path(length):
+    return f"{FILLER_DIR}/blank_{length}s.mp4"
 
-            print(f"Added event video: {file_path} at line {line_number}, current time: {current_time}")
-            line_number += 2  # Event video adds 2 lines (file + duration)
 
-            # Update current time to the end of the event
-            current_time = end_time
+def render_filler(length):
+    """Render a blank filler clip of `length` seconds by looping the blank video as often as needed.
 
-        # Fill remaining time to the end of the day (23:59:59) with blank videos
-        end_of_day = datetime.combine(datetime.fromisoformat(date), datetime.max.time())
-        end_of_day = LOCAL_TIMEZONE.localize(end_of_day)
-        print(f"End of Day: {end_of_day}")
+    Fillers are cached under FILLER_DIR, so each of FILLER_LENGTHS is only rendered the
+    first time. Returns the path relative to EVENT_FILE_DIR or None if ffmpeg failed.
+    """
+    relative_path = filler_path(length)
+    output_path = os.path.join(EVENT_FILE_DIR, relative_path)
+    if os.path.exists(output_path):
+        return relative_path
 
-        if current_time < end_of_day:
-            remaining_duration = (end_of_day - current_time).total_seconds()
-            full_blanks = int(remaining_duration // 10)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tmp_path = f"{output_path}.tmp.mp4"
+    try:
+        result = subprocess.run(
+            [
+                'ffmpeg', '-y', '-v', 'error',
+                '-stream_loop', '-1', '-i', os.path.join(EVENT_FILE_DIR, BLANK_VIDEO_PATH),
+                '-t', str(length), '-c', 'copy', tmp_path
+            ],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE
+        )
+    except OSError as e:
+        print(f"Error rendering {length}s filler: {e}")
+        return None
 
-            # Append full blank video repetitions
-            for _ in range(full_blanks):
-                lines.append(f"file '{BLANK_VIDEO_PATH}'")
-  #              lines.append("duration 1")
-                line_number += 2  # Each blank video adds 2 lines (file + duration)
+    if result.returncode != 0:
+        print(f"Error rendering {length}s filler: {result.stderr.decode('utf-8')}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        return None
 
-        # Write the event file
-        event_file_path = os.path.join(EVENT_FILE_DIR, f"{date}.txt")
-        with open(event_file_path, 'w') as f:
-            f.write('\n'.join(lines))
+    os.replace(tmp_path, output_path)
+    print(f"Rendered filler: {output_path}")
+    return relative_path
+
+
+def prepare_fillers():
+    """Render the FILLER_LENGTHS clips and delete any other filler left in FILLER_DIR."""
+    if FILLER_MODE != 'rendered':
+        return
+    for length in FILLER_LENGTHS:
+        render_filler(length)
+    keep = {os.path.basename(filler_path(length)) for length in FILLER_LENGTHS}
+    filler_dir = os.path.join(EVENT_FILE_DIR, FILLER_DIR)
+    for name in os.listdir(filler_dir) if os.path.isdir(filler_dir) else []:
+        if name not in keep:
+            os.remove(os.path.join(filler_dir, name))
+            print(f"Removed unused filler: {name}")
+
+
+def _rendered_filler_lines(seconds):
+    longest = max(FILLER_LENGTHS)
+    repeats = int(seconds // longest)
+    remainder = seconds - repeats * longest
+    if remainder < 0.04 and repeats:
+        repeats, remainder = repeats - 1, longest
+
+    lines = []
+    if repeats:
+        filler = render_filler(longest)
+        if not filler:
+            return None
+        lines += [f"file '{filler}'"] * repeats
+    filler = render_filler(min(length for length in FILLER_LENGTHS if length >= remainder))
+    if not filler:
+        return None
+    return lines + [f"file '{filler}'", f"outpoint {remainder:.3f}"]
+
+
+def filler_lines(seconds):
+    """Concat lines that cover a gap of exactly `seconds` with blank video."""
+    if seconds <= 0:
+        return []
+
+    if FILLER_MODE == 'rendered':
+        lines = _rendered_filler_lines(seconds)
+        if lines:
+            return lines
+
+    # Repeat the blank clip and trim the last repetition to the remainder
+    full_blanks = int(seconds // BLANK_VIDEO_DURATION)
+    lines = [f"file '{BLANK_VIDEO_PATH}'"] * full_blanks
+    remainder = seconds - full_blanks * BLANK_VIDEO_DURATION
+    if remainder >= 0.04:  # Anything shorter is less than a frame
+        lines.append(f"file '{BLANK_VIDEO_PATH}'")
+        lines.append(f"outpoint {remainder:.3f}")
+    return lines
+
+
+def build_event_timeline(date, current_time=None):
+    """Build the playout timeline for a date as a list of event and filler items.
+
+    Each item is a dict with `kind` ('event' or 'filler'), `start` and `end` (localized
+    datetimes); events also carry `file_name`, `inpoint` and `duration`. Events come from
+    the compiled schedule (see schedule_compiler), so they are already validated, trimmed
+    to their slot and free of overlaps. The timeline starts at `current_time` (now by
+    default) and runs to the end of the day.
+    """
+    compiled = get_compiled_schedule(date)
+    events = [item for item in compiled['items'] if item['kind'] == 'event']
+
+    # Keep the day's assets in the local cache while they are scheduled
+    pin_assets((event['file_name'] for event in events), group=date)
+
+    if current_time is None:
+        # Get the current time in the specified timezone, truncated to the second
+        now = datetime.now(LOCAL_TIMEZONE)
+        current_time = LOCAL_TIMEZONE.localize(datetime.strptime(now.strftime('%Y-%m-%d %H:%M:%S'), '%Y-%m-%d %H:%M:%S'))
+    print(f"Current Time: {current_time}")
+
+    timeline = []
+    for event in events:
+        # Localize event times to the same timezone
+        start_time = LOCAL_TIMEZONE.localize(datetime.fromisoformat(event['start']))
+        end_time = LOCAL_TIMEZONE.localize(datetime.fromisoformat(event['end']))
+
+        # Skip event if it's already in the past
+        if start_time < current_time:
+            print(f"Skipping event {event['file_name']} as it is in the past ({start_time})")
+            continue
+
+        # Fill gap with blank video if current time is before the event's start time
+        if current_time < start_time:
+            timeline.append({'kind': 'filler', 'start': current_time, 'end': start_time})
+
+        timeline.append({'kind': 'event', 'file_name': event['file_name'], 'start': start_time, 'end': end_time,
+                         'inpoint': event['inpoint'], 'duration': event['duration']})
+        print(f"Added event video: {event['file_name']} at {start_time}")
+
+        # Update current time to the end of the event
+        current_time = end_time
+
+    # Fill remaining time to the end of the day with blank video
+    end_of_day = LOCAL_TIMEZONE.localize(datetime.fromisoformat(date) + timedelta(days=1))
+    print(f"End of Day: {end_of_day}")
+    if current_time < end_of_day:
+        timeline.append({'kind': 'filler', 'start': current_time, 'end': end_of_day})
+
+    return timeline
+
+
+def timeline_to_lines(timeline):
+    """Render timeline items as concat demuxer lines.
+
+    Event assets are referenced from the local asset cache (downloads are queued here) and
+    only fall back to a presigned S3 URL when they start too soon to be cached in time.
+    """
+    now = datetime.now(LOCAL_TIMEZONE)
+    lines = []
+    for item in timeline:
+        if item['kind'] == 'filler':
+            lines.extend(filler_lines((item['end'] - item['start']).total_seconds()))
+        else:
+            file_path = resolve_asset(item['file_name'],
+                                      (item['start'] - now).total_seconds(),
+                                      (item['end'] - item['start']).total_seconds())
+            lines.append(f"file '{file_path}'")
+            # Play exactly the compiled slot of the asset
+            if item['inpoint']:
+                lines.append(f"inpoint {item['inpoint']:.6f}")
+            lines.append(f"outpoint {item['inpoint'] + item['duration']:.6f}")
+            lines.append(f"duration {item['duration']:.6f}")
+    return lines
 
-        print(f"Event file generated successfully: {event_file_path}")
-    except Exception as e:
-        print(f"Error generating event file: {e}")
 
 # Function to start FFmpeg stream
 def start_stream(date):
@@ -117,34 +209,12 @@ def start_stream(date):
 
 def get_video_duration_from_s3(bucket_name, object_key):
     try:
-        # Generate a pre-signed URL for the S3 object
         print(f"Bucket name: {bucket_name}")
         print(f"Object key: {object_key}")
-        url = s3_client.generate_presigned_url('get_object',
-                                               Params={'Bucket': bucket_name, 'Key': object_key},
-                                               ExpiresIn=3600)  # URL valid for 1 hour
 
-        # Use subprocess to call ffprobe on the URL
-        print(f"Probing video at URL: {url}")
-        result = subprocess.run(
-            [
-                'ffprobe',
-                '-v', 'error',
-                '-select_streams', 'v:0',
-                '-show_entries', 'stream=duration',
-                '-of', 'json',
-                url
-            ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-
-        # Parse the ffprobe output
-        if result.returncode != 0:
-            raise Exception(f"ffprobe error: {result.stderr.decode('utf-8')}")
-
-        probe_data = json.loads(result.stdout)
-        duration = float(probe_data['streams'][0]['duration'])
+        # Full probe results are cached by ETag, ffprobe only runs for unseen content
+        _, info = probe_asset(bucket_name, object_key)
+        duration = info['duration']
 
         print(f"The duration of the video is {duration:.2f} seconds")
         return duration
@@ -152,24 +222,3 @@ def get_video_duration_from_s3(bucket_name, object_key):
     except Exception as e:
         print(f"Error retrieving video duration: {e}")
         return None
-
-def add_metadata(file_name, bucket_name, duration):
-    try:
-        # Check if the file already exists in the database
-        existing_metadata = metadata_db.getByQuery({"file_name": file_name})
-        if existing_metadata:
-            print(f"Metadata for {file_name} already exists.")
-            return False
-
-        # Add the metadata to the database
-        metadata_db.add({
-            "file_name": file_name,
-            "bucket_name": bucket_name,
-            "duration": duration
-        })
-        print(f"Metadata for {file_name} added successfully.")
-        return True
-    except Exception as e:
-        print(f"Error adding metadata: {e}")
-        return False
-